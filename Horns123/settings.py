@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -37,6 +39,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'shop',
     'rest_framework',
     'drf_yasg',
@@ -129,3 +132,47 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Django REST framework
+# MessagePack is offered through content negotiation only when the msgpack package is installed.
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'shop.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ] + (['shop.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
+    'DEFAULT_PARSER_CLASSES': [
+        'shop.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ] + (['shop.renderers.MessagePackParser'] if find_spec('msgpack') else []),
+}
+
+# Transactional outbox: event type -> list of dotted paths to handlers (see shop.outbox)
+SHOP_OUTBOX_HANDLERS = {
+    'order.created': [],
+}
+
+# Days processed and failed outbox events are kept before run_outbox_worker deletes them
+SHOP_OUTBOX_RETENTION_DAYS = 7
+
+# Range-partition shop_order by created_at month (PostgreSQL only, see shop.partitions).
+# Enables the manage_order_partitions command; run it with --convert once to switch the table over.
+SHOP_PARTITIONED_ORDERS = False
+
+# How long (seconds) items added to a cart stay reserved; expired holds are released by expire_cart_reservations
+SHOP_CART_RESERVATION_TTL = 15 * 60
+
+# Seconds a product representation stays in the cache used by GET /api/products/?ids=... (see shop.cache)
+SHOP_PRODUCT_CACHE_TIMEOUT = 300
+
+# shop.cache must be shared by all worker processes: a per-process cache keeps serving entries that another
+# worker has already invalidated. Configure a shared backend in production, e.g.
+#   SHOP_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache SHOP_CACHE_LOCATION=redis://cache:6379/1
+# The local-memory default is only suitable for development and tests running in a single process.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('SHOP_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('SHOP_CACHE_LOCATION', ''),
+    },
+}
@@ -1,3 +1,158 @@
 from django.contrib import admin
+from django.contrib.admin.utils import lookup_spawns_duplicates
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections, models
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.text import smart_split, unescape_string_literal
+from mptt.admin import MPTTModelAdmin
 
-# Register your models here.
+from .models import Category, Product, Cart, CartItem, Order, OrderItem
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Для неотфильтрованного списка большой таблицы в PostgreSQL берёт оценку числа строк из pg_class
+    вместо SELECT COUNT(*). С фильтрами и поиском считает точно.
+    """
+    estimate_threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                               [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] >= self.estimate_threshold:
+                return row[0]
+        return super().count
+
+
+class IndexedSearchMixin:
+    """
+    Поиск без учёта регистра для текстовых полей ('^поле' — istartswith, '=поле' — iexact), как в стандартной
+    админке; такие сравнения UPPER(поле) обслуживают функциональные индексы (см. миграцию 0012).
+    Нетекстовые '=поля' (id) сравниваются точным exact, чтобы работал первичный ключ или индекс внешнего ключа,
+    а не UPPER(id::text). Значения, которые нельзя привести к типу поля ('abc' для '=id'), это поле не находят.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        search_fields = self.get_search_fields(request)
+        if not search_fields or not search_term or not all(
+                field.startswith(('^', '=')) for field in search_fields):
+            return super().get_search_results(request, queryset, search_term)
+
+        lookups = []
+        for name in search_fields:
+            field, path = self._search_field(name[1:]), name[1:]
+            text = isinstance(field, (models.CharField, models.TextField))
+            if name[0] == '^':
+                lookups.append((field, path, 'istartswith', text))
+            else:
+                lookups.append((field, path, 'iexact' if text else 'exact', text))
+
+        term_queries = []
+        for bit in smart_split(search_term):
+            if bit.startswith(('"', "'")) and bit[0] == bit[-1]:
+                bit = unescape_string_literal(bit)
+            or_queries = Q(pk__in=[])
+            for field, path, lookup, text in lookups:
+                try:
+                    value = bit if text else field.to_python(bit)
+                except ValidationError:
+                    continue
+                or_queries |= Q(**{f'{path}__{lookup}': value})
+            term_queries.append(or_queries)
+        queryset = queryset.filter(*term_queries)
+        may_have_duplicates = any(lookup_spawns_duplicates(self.opts, path) for _, path, _, _ in lookups)
+        return queryset, may_have_duplicates
+
+    def _search_field(self, path):
+        model = self.model
+        for name in path.split('__'):
+            field = model._meta.get_field(name)
+            model = field.related_model
+        return field
+
+
+class LargeTableAdmin(IndexedSearchMixin, admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+    ordering = ['-id']
+
+
+@admin.register(Category)
+class CategoryAdmin(IndexedSearchMixin, MPTTModelAdmin):
+    list_display = ['name', 'id']
+    search_fields = ['^name']
+
+
+@admin.register(Product)
+class ProductAdmin(LargeTableAdmin):
+    list_display = ['id', 'name', 'price', 'stock']
+    search_fields = ['=id', '^name']
+    # Остаток и число частей меняет только команда set_stock: без строк StockShard покупки были бы невозможны
+    readonly_fields = ['stock', 'stock_shards']
+    autocomplete_fields = ['categories']
+
+
+class ReadonlyProductInline(admin.TabularInline):
+    """
+    Продукт позиции показывается только для чтения из select_related: виджет raw_id загружал бы подпись
+    каждой строки отдельным запросом. Позиции создаются через API, в админке меняют количество или удаляют.
+    """
+    readonly_fields = ['product']
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
+
+class CartItemInline(ReadonlyProductInline):
+    model = CartItem
+
+
+@admin.register(Cart)
+class CartAdmin(LargeTableAdmin):
+    list_display = ['id', 'user']
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+    search_fields = ['=user__username']
+    inlines = [CartItemInline]
+
+
+@admin.register(CartItem)
+class CartItemAdmin(LargeTableAdmin):
+    list_display = ['id', 'cart', 'product', 'quantity']
+    list_select_related = ['cart', 'product']
+    raw_id_fields = ['cart', 'product']
+    search_fields = ['=cart__user__username', '=product__id']
+
+
+class OrderItemInline(ReadonlyProductInline):
+    model = OrderItem
+
+
+@admin.register(Order)
+class OrderAdmin(LargeTableAdmin):
+    list_display = ['id', 'user', 'created_at']
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+    search_fields = ['=id', '=user__username']
+    inlines = [OrderItemInline]
+
+
+@admin.register(OrderItem)
+class OrderItemAdmin(LargeTableAdmin):
+    list_display = ['id', 'order', 'product', 'quantity']
+    list_select_related = ['order', 'product']
+    raw_id_fields = ['order', 'product']
+    search_fields = ['=order__id', '=product__id']
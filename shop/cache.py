@@ -0,0 +1,87 @@
+"""
+Кэш представлений продуктов для мульти-запроса GET /api/products/?ids=...
+
+В кэше лежит полное представление продукта (как у ProductSerializer). Ключ записи включает две версии:
+версию дерева категорий (растёт при любом изменении категорий) и версию самого продукта (растёт при изменении
+продукта и его связей с категориями, после фиксации транзакции — см. shop.signals). Записи никогда не удаляются
+и не перезаписываются: после увеличения версии старые записи просто перестают читаться и вытесняются по таймауту.
+
+Версии читаются до обращения к базе (versions()), и промах заполняется под теми же версиями (set_products()).
+Если запрос прочитал из базы старые данные, а изменение зафиксировалось и увеличило версию раньше, чем он записал
+их в кэш, эта запись окажется под старой версией и читаться не будет.
+
+Вытесненный ключ версии заново заводится значением time.time_ns(), а не 1, поэтому версия не может вернуться
+к уже использованному значению и «воскресить» старые записи.
+
+Бэкенд кэша должен быть общим для всех процессов приложения (см. CACHES в настройках): локальный кэш процесса
+продолжит отдавать записи, которые другой процесс уже сделал недействительными.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+CATEGORY_VERSION_KEY = 'shop:category_version'
+DEFAULT_TIMEOUT = 300
+
+
+def _product_version_key(product_id):
+    return f'shop:product_version:{product_id}'
+
+
+def _get_versions(keys):
+    """Текущие значения ключей версий; отсутствующие (ещё не созданные или вытесненные) заводятся заново."""
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            value = time.time_ns()
+            # Параллельный запрос мог успеть завести ключ первым — тогда берём его значение
+            found[key] = value if cache.add(key, value, timeout=None) else cache.get(key, value)
+    return found
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Ключа нет — все записи под прежними версиями и так не читаются; заводим новое значение
+        cache.add(key, time.time_ns(), timeout=None)
+
+
+def category_version():
+    return _get_versions([CATEGORY_VERSION_KEY])[CATEGORY_VERSION_KEY]
+
+
+def bump_category_version():
+    """Делает недействительными все закэшированные продукты (их деревья категорий могли измениться)."""
+    _bump(CATEGORY_VERSION_KEY)
+
+
+def versions(product_ids):
+    """Снимок версий для product_ids; берётся до чтения из базы и передаётся в get_products/set_products."""
+    keys = {product_id: _product_version_key(product_id) for product_id in product_ids}
+    current = _get_versions([CATEGORY_VERSION_KEY, *keys.values()])
+    category = current[CATEGORY_VERSION_KEY]
+    return {product_id: (category, current[key]) for product_id, key in keys.items()}
+
+
+def _key(product_id, version):
+    category, product = version
+    return f'shop:product:{category}:{product}:{product_id}'
+
+
+def get_products(snapshot):
+    """Возвращает {id: представление} для найденных в кэше продуктов из снимка версий."""
+    keys = {product_id: _key(product_id, version) for product_id, version in snapshot.items()}
+    cached = cache.get_many(list(keys.values()))
+    return {product_id: cached[key] for product_id, key in keys.items() if key in cached}
+
+
+def set_products(data, snapshot):
+    timeout = getattr(settings, 'SHOP_PRODUCT_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+    cache.set_many({_key(item['id'], snapshot[item['id']]): item for item in data}, timeout=timeout)
+
+
+def invalidate_products(product_ids):
+    for product_id in product_ids:
+        _bump(_product_version_key(product_id))
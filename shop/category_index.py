@@ -0,0 +1,61 @@
+from django.db import transaction
+
+from .models import Category, Product, ProductCategoryIndex
+
+BATCH_SIZE = 1000
+
+
+def _ancestor_ids(category_ids):
+    """Возвращает словарь {id категории: [id всех её предков, включая саму категорию]}."""
+    category_ids = set(category_ids)
+    tree_ids = Category.objects.filter(id__in=category_ids).values('tree_id')
+    parents = dict(Category.objects.filter(tree_id__in=tree_ids).values_list('id', 'parent_id'))
+
+    ancestors = {}
+    for category_id in category_ids & parents.keys():
+        chain = []
+        current = category_id
+        while current is not None:
+            chain.append(current)
+            current = parents.get(current)
+        ancestors[category_id] = chain
+    return ancestors
+
+
+def rebuild_product_index(product_ids):
+    """Пересчитывает строки индекса предков категорий для указанных продуктов."""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+
+    through = Product.categories.through
+    links = list(through.objects.filter(product_id__in=product_ids).values_list('product_id', 'category_id'))
+    ancestors = _ancestor_ids(category_id for _, category_id in links)
+
+    rows = set()
+    for product_id, category_id in links:
+        for ancestor_id in ancestors.get(category_id, ()):
+            rows.add((product_id, ancestor_id))
+
+    with transaction.atomic():
+        ProductCategoryIndex.objects.filter(product_id__in=product_ids).delete()
+        # Параллельный пересчёт того же продукта мог уже вставить те же строки
+        ProductCategoryIndex.objects.bulk_create(
+            [ProductCategoryIndex(product_id=product_id, category_id=category_id) for product_id, category_id in rows],
+            batch_size=BATCH_SIZE, ignore_conflicts=True,
+        )
+
+
+def products_in_subtree(category):
+    """Идентификаторы продуктов, привязанных к категории или любой из её подкатегорий."""
+    return set(ProductCategoryIndex.objects.filter(category=category).values_list('product_id', flat=True))
+
+
+def rebuild_all():
+    """Полностью пересобирает индекс. Возвращает количество обработанных продуктов."""
+    product_ids = list(Product.objects.values_list('id', flat=True).order_by('id'))
+    with transaction.atomic():
+        ProductCategoryIndex.objects.all().delete()
+        for start in range(0, len(product_ids), BATCH_SIZE):
+            rebuild_product_index(product_ids[start:start + BATCH_SIZE])
+    return len(product_ids)
@@ -0,0 +1,144 @@
+"""
+Складские остатки и резервирование.
+
+Списание — условный UPDATE ... SET stock = stock - n WHERE stock >= n, без чтения строки и явных блокировок.
+Для «горячих» товаров (Product.stock_shards > 0) остаток разбит на StockShard, и параллельные покупатели
+списывают со случайных частей. Добавление в корзину резервирует товар на SHOP_CART_RESERVATION_TTL секунд;
+просроченные резервы возвращает на склад команда expire_cart_reservations.
+"""
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import Product, StockShard, CartItem
+
+DEFAULT_RESERVATION_TTL = 15 * 60
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id):
+        super().__init__(f'Недостаточно товара {product_id} на складе')
+        self.product_id = product_id
+
+
+def reservation_ttl():
+    return timedelta(seconds=getattr(settings, 'SHOP_CART_RESERVATION_TTL', DEFAULT_RESERVATION_TTL))
+
+
+def _reserve_sharded(product, quantity):
+    shards = list(range(product.stock_shards))
+    random.shuffle(shards)
+    for shard in shards:
+        if StockShard.objects.filter(product=product, shard=shard, quantity__gte=quantity).update(
+                quantity=F('quantity') - quantity):
+            return True
+
+    # Ни в одной части не хватает целиком: блокируем все части и списываем по очереди
+    with transaction.atomic():
+        rows = list(StockShard.objects.select_for_update().filter(product=product).order_by('shard'))
+        if sum(row.quantity for row in rows) < quantity:
+            return False
+        for row in rows:
+            taken = min(row.quantity, quantity)
+            if taken:
+                StockShard.objects.filter(pk=row.pk).update(quantity=F('quantity') - taken)
+                quantity -= taken
+    return True
+
+
+def reserve(product, quantity):
+    """Списывает quantity единиц товара; при нехватке бросает OutOfStock."""
+    if quantity <= 0:
+        return
+    if product.stock_shards:
+        reserved = _reserve_sharded(product, quantity)
+    else:
+        reserved = bool(Product.objects.filter(pk=product.pk, stock__gte=quantity).update(
+            stock=F('stock') - quantity))
+        if not reserved:
+            # Остаток не отслеживается — ограничений нет
+            reserved = Product.objects.filter(pk=product.pk, stock__isnull=True).exists()
+    if not reserved:
+        raise OutOfStock(product.pk)
+
+
+def release(product, quantity):
+    """Возвращает quantity единиц товара на склад."""
+    if quantity <= 0:
+        return
+    if product.stock_shards:
+        StockShard.objects.filter(product=product, shard=random.randrange(product.stock_shards)).update(
+            quantity=F('quantity') + quantity)
+    else:
+        Product.objects.filter(pk=product.pk, stock__isnull=False).update(stock=F('stock') + quantity)
+
+
+def available(product):
+    if product.stock_shards:
+        return StockShard.objects.filter(product=product).aggregate(total=Sum('quantity'))['total'] or 0
+    return Product.objects.values_list('stock', flat=True).get(pk=product.pk)
+
+
+def set_stock(product, quantity, shards=0):
+    """Устанавливает остаток товара; при shards > 0 делит его поровну между частями."""
+    with transaction.atomic():
+        StockShard.objects.filter(product=product).delete()
+        if shards:
+            StockShard.objects.bulk_create([
+                StockShard(product=product, shard=shard, quantity=quantity // shards + (shard < quantity % shards))
+                for shard in range(shards)
+            ])
+            product.stock = None
+        else:
+            product.stock = quantity
+        product.stock_shards = shards
+        product.save(update_fields=['stock', 'stock_shards'])
+
+
+def hold(cart_item, quantity):
+    """Доводит резерв позиции корзины до quantity единиц и продлевает его. Позицию сохраняет вызывающий код."""
+    delta = quantity - cart_item.reserved
+    if delta > 0:
+        reserve(cart_item.product, delta)
+    else:
+        release(cart_item.product, -delta)
+    cart_item.reserved = quantity
+    cart_item.reserved_until = timezone.now() + reservation_ttl()
+
+
+def drop(cart_item):
+    """Снимает резерв позиции, если его ещё не вернула на склад очистка просроченных резервов."""
+    if cart_item.reserved and CartItem.objects.filter(pk=cart_item.pk, reserved=cart_item.reserved).update(
+            reserved=0, reserved_until=None):
+        release(cart_item.product, cart_item.reserved)
+    cart_item.reserved = 0
+
+
+def checkout(cart_items):
+    """Превращает резервы позиций в списание при оформлении заказа, докупая недостающее со склада."""
+    for item in cart_items:
+        claimed = item.reserved and CartItem.objects.filter(pk=item.pk, reserved=item.reserved).update(
+            reserved=0, reserved_until=None)
+        held = item.reserved if claimed else 0
+        if item.quantity > held:
+            reserve(item.product, item.quantity - held)
+        else:
+            release(item.product, held - item.quantity)
+
+
+def expire_reservations():
+    """Возвращает на склад просроченные резервы корзин. Возвращает количество снятых резервов."""
+    expired = (CartItem.objects.filter(reserved__gt=0, reserved_until__lt=timezone.now())
+               .select_related('product').order_by('reserved_until'))
+    count = 0
+    for item in expired.iterator():
+        with transaction.atomic():
+            if CartItem.objects.filter(pk=item.pk, reserved=item.reserved, reserved_until=item.reserved_until).update(
+                    reserved=0, reserved_until=None):
+                release(item.product, item.reserved)
+                count += 1
+    return count
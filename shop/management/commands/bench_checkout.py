@@ -0,0 +1,72 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from shop.inventory import set_stock, available
+from shop.models import Product, Order, OutboxEvent
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест оформления заказов: много покупателей параллельно покупают один «горячий» товар. '
+            'Создаёт временные товар и пользователей и удаляет их после прогона.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=32, help='Количество параллельных покупателей')
+        parser.add_argument('--orders', type=int, default=20, help='Заказов на покупателя')
+        parser.add_argument('--stock', type=int, default=500)
+        parser.add_argument('--shards', type=int, default=0, help='Число частей остатка (0 — без шардирования)')
+
+    def handle(self, *args, **options):
+        product = Product.objects.create(name='bench-checkout', description='', price=1)
+        set_stock(product, options['stock'], options['shards'])
+        users = [User.objects.create_user(username=f'bench-checkout-{i}') for i in range(options['buyers'])]
+        results = {'created': 0, 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+
+        def buyer(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                for _ in range(options['orders']):
+                    try:
+                        added = client.post(reverse('cart-list'), {'product_id': product.id, 'quantity': 1},
+                                            format='json')
+                        if added.status_code == 200:
+                            added = client.post(reverse('order-list'), format='json')
+                        key = {201: 'created', 409: 'rejected'}.get(added.status_code, 'errors')
+                    except Exception:
+                        key = 'errors'
+                    with lock:
+                        results[key] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buyer, args=(user,)) for user in users]
+        # APIClient ходит с Host: testserver
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+        left = available(product)
+        sold = options['stock'] - left
+        self.stdout.write(
+            f"orders={results['created']} rejected={results['rejected']} errors={results['errors']} "
+            f"time={elapsed:.2f}s throughput={results['created'] / elapsed:.1f} orders/s "
+            f"stock_left={left} oversold={'yes' if results['created'] > sold else 'no'}"
+        )
+
+        OutboxEvent.objects.filter(payload__user_id__in=[user.pk for user in users]).delete()
+        Order.objects.filter(user__in=users).delete()
+        User.objects.filter(pk__in=[user.pk for user in users]).delete()
+        product.delete()
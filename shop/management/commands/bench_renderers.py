@@ -0,0 +1,47 @@
+import io
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from shop.models import Product
+from shop.renderers import FastJSONRenderer, FastJSONParser, MessagePackRenderer, MessagePackParser, msgpack
+from shop.serializers import ProductSerializer
+
+
+class Command(BaseCommand):
+    help = 'Микробенчмарк рендеринга и парсинга вывода ProductSerializer: стандартный JSON, orjson и MessagePack.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Количество строк в ответе')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        products = Product.objects.prefetch_related('categories')[:rows]
+        data = ProductSerializer(products, many=True).data
+        if not data:
+            raise CommandError('Нет продуктов для бенчмарка')
+        # Дополняем до нужного размера копиями реальных строк
+        data = (list(data) * (rows // len(data) + 1))[:rows]
+
+        candidates = [('json', JSONRenderer(), JSONParser()), ('orjson', FastJSONRenderer(), FastJSONParser())]
+        if msgpack is not None:
+            candidates.append(('msgpack', MessagePackRenderer(), MessagePackParser()))
+
+        for name, renderer, parser in candidates:
+            render_time = self.best_of(options['repeat'], lambda: renderer.render(data))
+            body = renderer.render(data)
+            parse_time = self.best_of(options['repeat'], lambda: parser.parse(io.BytesIO(body)))
+            self.stdout.write(f'{name:8} render={render_time * 1000:8.1f} ms  parse={parse_time * 1000:8.1f} ms  '
+                              f'size={len(body)} bytes')
+
+    def best_of(self, repeat, func):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from shop.recommendations import rebuild_recommendations, update_recommendations, TOP_K
+
+
+class Command(BaseCommand):
+    help = ('Обновляет рекомендации «часто покупают вместе» по новым заказам. '
+            'С --rebuild пересчитывает их по всей истории заказов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Пересчитать рекомендации с нуля')
+        parser.add_argument('--top-k', type=int, default=TOP_K, help='Сколько соседей хранить для товара')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            count = rebuild_recommendations(options['top_k'])
+        else:
+            count = update_recommendations(options['top_k'])
+        self.stdout.write(self.style.SUCCESS(f'Обновлены рекомендации для {count} товаров'))
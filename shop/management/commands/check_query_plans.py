@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.query_plans import QueryPlanChecker, LARGE_TABLE_ROWS
+
+
+class Command(BaseCommand):
+    help = ('Запускает EXPLAIN для запросов ProductViewSet, CartViewSet и OrderViewSet на заполненной БД '
+            'и завершается с ошибкой при последовательном сканировании больших таблиц.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-rows', type=int, default=LARGE_TABLE_ROWS,
+                            help='Минимальный размер таблицы, для которой Seq Scan считается ошибкой')
+        parser.add_argument('--prefer-indexes', action='store_true',
+                            help='Запретить планировщику Seq Scan, если есть индекс (для небольших баз)')
+
+    def handle(self, *args, **options):
+        try:
+            violations = QueryPlanChecker(min_rows=options['min_rows'],
+                                          prefer_indexes=options['prefer_indexes']).run()
+        except RuntimeError as exc:
+            raise CommandError(str(exc))
+
+        for action, table, rows, sql in violations:
+            self.stderr.write(f'{action}: Seq Scan on {table} (~{rows} строк)\n  {sql}')
+        if violations:
+            raise CommandError(f'Найдено последовательных сканирований: {len(violations)}')
+        self.stdout.write(self.style.SUCCESS('Последовательных сканирований больших таблиц не найдено'))
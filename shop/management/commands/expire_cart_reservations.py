@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.inventory import expire_reservations
+
+
+class Command(BaseCommand):
+    help = 'Возвращает на склад товары из просроченных резервов корзин.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Работать постоянно')
+        parser.add_argument('--interval', type=float, default=30.0, help='Пауза между проходами в секундах')
+
+    def handle(self, *args, **options):
+        while True:
+            count = expire_reservations()
+            if count or not options['loop']:
+                self.stdout.write(f'Снято просроченных резервов: {count}')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
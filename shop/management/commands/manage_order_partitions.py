@@ -0,0 +1,49 @@
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from shop import partitions
+
+
+class Command(BaseCommand):
+    help = ('Обслуживание помесячных секций таблицы заказов (PostgreSQL): перевод таблицы в секционированный '
+            'режим, создание будущих секций и архивирование старых.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true',
+                            help='Перевести shop_order в секционированную таблицу')
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help='На сколько месяцев вперёд создавать секции')
+        parser.add_argument('--archive-before', metavar='YYYY-MM',
+                            help='Отсоединить секции за месяцы раньше указанного')
+        parser.add_argument('--archive-dir',
+                            help='Выгрузить отсоединённые секции в сжатые CSV в этот каталог и удалить их из БД')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Секционирование заказов поддерживается только на PostgreSQL')
+        if not getattr(settings, 'SHOP_PARTITIONED_ORDERS', False):
+            raise CommandError('Режим секционирования выключен: установите SHOP_PARTITIONED_ORDERS = True')
+
+        if options['convert']:
+            if partitions.is_partitioned():
+                raise CommandError('Таблица заказов уже секционирована')
+            partitions.convert_to_partitioned(options['months_ahead'])
+            self.stdout.write(self.style.SUCCESS('Таблица заказов переведена в секционированный режим'))
+        elif not partitions.is_partitioned():
+            raise CommandError('Таблица заказов не секционирована, запустите команду с --convert')
+
+        created = partitions.ensure_partitions(options['months_ahead'])
+        self.stdout.write(f'Секции на ближайшие месяцы: {", ".join(created)}')
+
+        if options['archive_before']:
+            try:
+                year, month = map(int, options['archive_before'].split('-'))
+                before = date(year, month, 1)
+            except ValueError:
+                raise CommandError('--archive-before ожидает месяц в формате YYYY-MM')
+            archived = partitions.archive_partitions(before, options['archive_dir'])
+            action = 'Заархивированы' if options['archive_dir'] else 'Отсоединены'
+            self.stdout.write(self.style.SUCCESS(f'{action} секции: {", ".join(archived) or "нет"}'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from shop.category_index import rebuild_all
+
+
+class Command(BaseCommand):
+    help = 'Полностью пересобирает индекс продукт -> предки категорий (shop_productcategoryindex).'
+
+    def handle(self, *args, **options):
+        count = rebuild_all()
+        self.stdout.write(self.style.SUCCESS(f'Индекс категорий пересобран для {count} продуктов'))
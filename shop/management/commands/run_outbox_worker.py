@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.outbox import OutboxDispatcher, pending_stats, purge_events, DEFAULT_BATCH_SIZE, DEFAULT_MAX_ATTEMPTS
+
+
+class Command(BaseCommand):
+    help = 'Доставляет события транзакционного outbox обработчикам из SHOP_OUTBOX_HANDLERS.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS)
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Пауза в секундах, когда очередь пуста')
+        parser.add_argument('--stats-every', type=int, default=100,
+                            help='Выводить счётчики каждые N пачек')
+        parser.add_argument('--purge-every', type=float, default=3600.0,
+                            help='Раз в сколько секунд удалять старые обработанные события '
+                                 '(срок хранения — SHOP_OUTBOX_RETENTION_DAYS)')
+        parser.add_argument('--once', action='store_true', help='Обработать очередь и завершиться')
+
+    def handle(self, *args, **options):
+        dispatcher = OutboxDispatcher(batch_size=options['batch_size'], max_attempts=options['max_attempts'])
+        next_purge = time.monotonic()
+        while True:
+            if time.monotonic() >= next_purge:
+                purged = purge_events()
+                if purged:
+                    self.stdout.write(f'purged={purged}')
+                next_purge = time.monotonic() + options['purge_every']
+            claimed = dispatcher.dispatch_batch()
+            if dispatcher.stats['batches'] % options['stats_every'] == 0 or (options['once'] and not claimed):
+                self.write_stats(dispatcher)
+            if not claimed:
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+
+    def write_stats(self, dispatcher):
+        stats = dispatcher.stats
+        pending = pending_stats()
+        self.stdout.write(
+            f"processed={stats['processed']} retried={stats['retried']} failed={stats['failed']} "
+            f"throughput={dispatcher.throughput():.1f}/s pending={pending['pending']} "
+            f"lag={pending['lag_seconds']:.1f}s"
+        )
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.inventory import set_stock
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Устанавливает складской остаток товара, при необходимости разбивая его на части для «горячих» товаров.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_id', type=int)
+        parser.add_argument('quantity', type=int)
+        parser.add_argument('--shards', type=int, default=0,
+                            help='Число частей остатка (0 — обычный счётчик в Product.stock)')
+
+    def handle(self, *args, **options):
+        if options['quantity'] < 0 or options['shards'] < 0:
+            raise CommandError('Остаток и число частей не могут быть отрицательными')
+        try:
+            product = Product.objects.get(pk=options['product_id'])
+        except Product.DoesNotExist:
+            raise CommandError('Продукт не найден')
+        set_stock(product, options['quantity'], options['shards'])
+        self.stdout.write(self.style.SUCCESS(f'Остаток товара {product.pk}: {options["quantity"]}'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from shop.rollups import update_sales_rollups, rebuild_sales_rollups, BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = ('Добавляет новые заказы в дневные сводки продаж по продуктам и категориям. '
+            'С --rebuild пересчитывает сводки по всей истории.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Пересчитать сводки с нуля')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            count = rebuild_sales_rollups(options['batch_size'])
+        else:
+            count = update_sales_rollups(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Учтено заказов: {count}'))
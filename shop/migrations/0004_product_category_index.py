@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 1000
+
+
+def populate_category_index(apps, schema_editor):
+    """Заполняет индекс по существующим связям: фильтры по категории читают только его."""
+    Category = apps.get_model('shop', 'Category')
+    Product = apps.get_model('shop', 'Product')
+    ProductCategoryIndex = apps.get_model('shop', 'ProductCategoryIndex')
+    parents = dict(Category.objects.values_list('id', 'parent_id'))
+
+    rows = set()
+    links = Product.categories.through.objects.order_by('id').values_list('product_id', 'category_id')
+    for product_id, category_id in links.iterator(chunk_size=BATCH_SIZE):
+        current = category_id
+        while current is not None:
+            rows.add((product_id, current))
+            current = parents.get(current)
+        if len(rows) >= BATCH_SIZE:
+            ProductCategoryIndex.objects.bulk_create(
+                [ProductCategoryIndex(product_id=p, category_id=c) for p, c in rows], ignore_conflicts=True)
+            rows.clear()
+    ProductCategoryIndex.objects.bulk_create(
+        [ProductCategoryIndex(product_id=p, category_id=c) for p, c in rows], ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0003_remove_product_category_product_categories'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCategoryIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_index', to='shop.category')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_index', to='shop.product')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='productcategoryindex',
+            constraint=models.UniqueConstraint(fields=('category', 'product'), name='shop_product_category_index_uniq'),
+        ),
+        migrations.RunPython(populate_category_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:53
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_cart_items(apps, schema_editor):
+    """Сливает повторяющиеся позиции (cart, product) перед добавлением уникального ограничения."""
+    CartItem = apps.get_model('shop', 'CartItem')
+    duplicates = (CartItem.objects.values('cart_id', 'product_id')
+                  .annotate(n=Count('id'), keep_id=Min('id'), total=Sum('quantity'))
+                  .filter(n__gt=1))
+    for row in duplicates:
+        CartItem.objects.filter(id=row['keep_id']).update(quantity=row['total'])
+        CartItem.objects.filter(cart_id=row['cart_id'], product_id=row['product_id']).exclude(
+            id=row['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_product_category_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='price',
+            field=models.DecimalField(db_index=True, decimal_places=2, max_digits=10),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at'], name='shop_order_user_created_idx'),
+        ),
+        migrations.RunPython(merge_duplicate_cart_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='shop_cartitem_cart_product_uniq'),
+        ),
+        # Автоматическая M2M-таблица не поддерживает Meta.indexes, поэтому составной индекс создаётся вручную.
+        migrations.RunSQL(
+            'CREATE INDEX shop_product_categories_category_product_idx '
+            'ON shop_product_categories (category_id, product_id);',
+            'DROP INDEX shop_product_categories_category_product_idx;',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:44
+
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(django.db.models.functions.comparison.Coalesce('processed_at', 'failed_at'), name='shop_outbox_done_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:50
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_outbox_done_index'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='varchar_pattern_ops'), name='shop_category_name_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['tree_id', 'lft'], name='shop_category_tree_id_lft_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='varchar_pattern_ops'), name='shop_product_name_upper_idx'),
+        ),
+        # Поиск '=user__username' в админке корзин и заказов: UPPER(username) = UPPER('...'). Таблица
+        # auth_user не наша, поэтому индекс создаётся вручную.
+        migrations.RunSQL(
+            'CREATE INDEX shop_auth_user_username_upper_idx ON auth_user (UPPER(username));',
+            'DROP INDEX shop_auth_user_username_upper_idx;',
+        ),
+    ]
@@ -1,5 +1,8 @@
 # shop/models.py
 from django.db import models
+from django.contrib.postgres.indexes import OpClass
+from django.db.models.functions import Coalesce, Upper
+from django.utils import timezone
 from django.contrib.auth.models import User
 from mptt.models import MPTTModel, TreeForeignKey
 
@@ -11,20 +14,71 @@ class Category(MPTTModel):
     class MPTTMeta:
         order_insertion_by = ['name']
 
+    class Meta:
+        indexes = [
+            # Поиск в админке и автодополнение категорий продукта: UPPER(name) LIKE 'ABC%'
+            models.Index(OpClass(Upper('name'), name='varchar_pattern_ops'), name='shop_category_name_upper_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
 
 class Product(models.Model):
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, db_index=True)
     description = models.TextField()
-    price = models.DecimalField(max_digits=10, decimal_places=2)
+    price = models.DecimalField(max_digits=10, decimal_places=2, db_index=True)
     categories = models.ManyToManyField(Category, related_name='products')
+    # Остаток на складе; None — остаток не отслеживается. При stock_shards > 0 остаток хранится в StockShard.
+    stock = models.PositiveIntegerField(null=True, blank=True)
+    stock_shards = models.PositiveSmallIntegerField(default=0)
+    STOCK_FIELDS = ('stock', 'stock_shards')
+
+    class Meta:
+        indexes = [
+            # Поиск в админке без учёта регистра: UPPER(name) LIKE 'ABC%'
+            models.Index(OpClass(Upper('name'), name='varchar_pattern_ops'), name='shop_product_name_upper_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Остаток меняется только условными UPDATE из shop.inventory. Обычное сохранение загруженного ранее
+        # экземпляра (API, админка) не должно записывать устаревший остаток поверх параллельных списаний.
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.STOCK_FIELDS]
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
 
+class StockShard(models.Model):
+    """Часть остатка «горячего» товара: резервирование списывает с одной из частей, разнося блокировки по строкам."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='shards')
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'shard'], name='shop_stock_shard_uniq'),
+        ]
+
+
+class ProductCategoryIndex(models.Model):
+    """
+    Денормализованная связь продукта со всеми предками каждой из его категорий (включая саму категорию).
+
+    Поддерживается сигналами из shop.signals, полностью пересобирается командой rebuild_category_index.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='category_index')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='product_index')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'product'], name='shop_product_category_index_uniq'),
+        ]
+
+
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart')
 
@@ -33,14 +87,107 @@ class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
+    # Сколько единиц товара зарезервировано под позицию и до какого момента (см. shop.inventory)
+    reserved = models.PositiveIntegerField(default=0)
+    reserved_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='shop_cartitem_cart_product_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['reserved_until'], name='shop_cartitem_reservation_idx',
+                         condition=models.Q(reserved__gt=0)),
+        ]
 
 
 class Order(models.Model):
     user = models.ForeignKey('auth.User', related_name='orders', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='shop_order_user_created_idx'),
+        ]
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, related_name='order_items', on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
+
+
+class OutboxEvent(models.Model):
+    """
+    Событие транзакционного outbox: пишется в той же транзакции, что и изменения данных,
+    и доставляется обработчикам отдельным воркером (команда run_outbox_worker).
+    """
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    failed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['available_at', 'id'], name='shop_outbox_pending_idx',
+                         condition=models.Q(processed_at__isnull=True, failed_at__isnull=True)),
+            # Очистка старых событий (shop.outbox.purge_events) ищет их по времени завершения
+            models.Index(Coalesce('processed_at', 'failed_at'), name='shop_outbox_done_idx'),
+        ]
+
+
+class ProductDailySales(models.Model):
+    """Дневная сводка продаж продукта. Заполняется командой update_sales_rollups (см. shop.rollups)."""
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    quantity = models.PositiveIntegerField(default=0)
+    lines = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'date'], name='shop_product_daily_sales_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='shop_product_sales_date_idx'),
+        ]
+
+
+class CategoryDailySales(models.Model):
+    """Дневная сводка продаж по поддереву категории: каждый продукт учитывается во всех предках своих категорий."""
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='daily_sales')
+    quantity = models.PositiveIntegerField(default=0)
+    lines = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'date'], name='shop_category_daily_sales_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='shop_category_sales_date_idx'),
+        ]
+
+
+class RollupCheckpoint(models.Model):
+    """Последний заказ, учтённый в сводках."""
+    name = models.CharField(max_length=100, unique=True)
+    last_order_id = models.BigIntegerField(default=0)
+
+
+class ProductRecommendation(models.Model):
+    """Товар, часто покупаемый вместе с product: score — число заказов, где они встречались вместе."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    score = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'recommended'], name='shop_product_recommendation_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['product', '-score'], name='shop_recommendation_top_idx'),
+        ]
@@ -0,0 +1,117 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+ORDER_CREATED = 'order.created'
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 5  # секунд, удваивается с каждой попыткой
+DEFAULT_RETENTION_DAYS = 7
+PURGE_BATCH_SIZE = 1000
+
+
+def publish(event_type, payload):
+    """Записывает событие в outbox. Вызывать внутри транзакции, в которой пишутся сами данные."""
+    return OutboxEvent.objects.create(event_type=event_type, payload=payload)
+
+
+def get_handlers(event_type):
+    """Обработчики события из настройки SHOP_OUTBOX_HANDLERS: {тип события: [путь к функции, ...]}."""
+    paths = getattr(settings, 'SHOP_OUTBOX_HANDLERS', {}).get(event_type, [])
+    return [import_string(path) for path in paths]
+
+
+def pending_stats():
+    """Количество ожидающих событий и отставание (в секундах) самого старого из них."""
+    pending = OutboxEvent.objects.filter(processed_at__isnull=True, failed_at__isnull=True)
+    oldest = pending.order_by('id').values_list('created_at', flat=True).first()
+    lag = (timezone.now() - oldest).total_seconds() if oldest else 0.0
+    return {'pending': pending.count(), 'lag_seconds': lag}
+
+
+def retention():
+    return timedelta(days=getattr(settings, 'SHOP_OUTBOX_RETENTION_DAYS', DEFAULT_RETENTION_DAYS))
+
+
+def purge_events(older_than=None, batch_size=PURGE_BATCH_SIZE):
+    """
+    Удаляет обработанные и окончательно неудавшиеся события, завершённые раньше older_than назад
+    (по умолчанию SHOP_OUTBOX_RETENTION_DAYS дней). Удаляет пачками, не держа длинных блокировок.
+    Возвращает количество удалённых событий.
+    """
+    cutoff = timezone.now() - (older_than if older_than is not None else retention())
+    done = (OutboxEvent.objects.alias(done_at=Coalesce('processed_at', 'failed_at'))
+            .filter(done_at__lt=cutoff).values_list('id', flat=True))
+    deleted = 0
+    while True:
+        ids = list(done[:batch_size])
+        if not ids:
+            return deleted
+        deleted += OutboxEvent.objects.filter(id__in=ids).delete()[0]
+
+
+class OutboxDispatcher:
+    """
+    Забирает события пачками через SELECT ... FOR UPDATE SKIP LOCKED, поэтому несколько воркеров
+    могут работать параллельно, не получая одно и то же событие. Ошибка обработчика откладывает событие
+    с экспоненциальной задержкой; после max_attempts попыток событие помечается как неудавшееся.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.stats = {'processed': 0, 'retried': 0, 'failed': 0, 'batches': 0, 'busy_seconds': 0.0}
+
+    def dispatch_batch(self):
+        """Обрабатывает одну пачку событий. Возвращает количество взятых событий."""
+        started = time.monotonic()
+        with transaction.atomic():
+            events = list(
+                OutboxEvent.objects.select_for_update(skip_locked=True)
+                .filter(processed_at__isnull=True, failed_at__isnull=True, available_at__lte=timezone.now())
+                .order_by('id')[:self.batch_size]
+            )
+            for event in events:
+                self.dispatch(event)
+        self.stats['batches'] += 1
+        self.stats['busy_seconds'] += time.monotonic() - started
+        return len(events)
+
+    def dispatch(self, event):
+        try:
+            with transaction.atomic():
+                for handler in get_handlers(event.event_type):
+                    handler(event)
+        except Exception as exc:
+            logger.exception('Ошибка обработки события outbox %s (%s)', event.id, event.event_type)
+            event.attempts += 1
+            event.last_error = repr(exc)
+            if event.attempts >= self.max_attempts:
+                event.failed_at = timezone.now()
+                self.stats['failed'] += 1
+            else:
+                event.available_at = timezone.now() + timedelta(seconds=RETRY_BASE_DELAY * 2 ** (event.attempts - 1))
+                self.stats['retried'] += 1
+            event.save(update_fields=['attempts', 'last_error', 'failed_at', 'available_at'])
+            return
+
+        event.attempts += 1
+        event.processed_at = timezone.now()
+        event.save(update_fields=['attempts', 'processed_at'])
+        self.stats['processed'] += 1
+
+    def throughput(self):
+        """Обработанных событий в секунду рабочего времени воркера."""
+        busy = self.stats['busy_seconds']
+        return self.stats['processed'] / busy if busy else 0.0
@@ -0,0 +1,155 @@
+"""
+Помесячное секционирование таблицы заказов (декларативное секционирование PostgreSQL по created_at).
+
+Режим включается настройкой SHOP_PARTITIONED_ORDERS и командой manage_order_partitions --convert.
+PostgreSQL не позволяет ссылаться внешним ключом на секционированную таблицу только по id, поэтому
+при переходе ограничение shop_orderitem.order_id -> shop_order снимается; каскадное удаление позиций
+по-прежнему выполняет Django.
+"""
+import gzip
+import os
+from datetime import date
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Order, OrderItem
+
+ORDER_TABLE = Order._meta.db_table
+ORDER_ITEM_TABLE = OrderItem._meta.db_table
+PARTITION_PREFIX = f'{ORDER_TABLE}_p'
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{PARTITION_PREFIX}{month:%Y%m}'
+
+
+def is_partitioned():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s", [ORDER_TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def list_partitions():
+    """Месячные секции в порядке возрастания: [(первое число месяца, имя таблицы), ...]."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s", [ORDER_TABLE])
+        names = [row[0] for row in cursor.fetchall()]
+    months = []
+    for name in names:
+        suffix = name[len(PARTITION_PREFIX):]
+        if name.startswith(PARTITION_PREFIX) and suffix.isdigit() and len(suffix) == 6:
+            months.append((date(int(suffix[:4]), int(suffix[4:]), 1), name))
+    return sorted(months)
+
+
+def create_partition(cursor, month):
+    qn = connection.ops.quote_name
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {qn(partition_name(month))} PARTITION OF {qn(ORDER_TABLE)} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')")
+
+
+def ensure_partitions(months_ahead=3):
+    """Создаёт недостающие секции с текущего месяца на months_ahead месяцев вперёд. Возвращает их имена."""
+    month = month_start(timezone.now())
+    last = add_months(month, months_ahead)
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        while month <= last:
+            create_partition(cursor, month)
+            created.append(partition_name(month))
+            month = add_months(month, 1)
+    return created
+
+
+def convert_to_partitioned(months_ahead=3):
+    """Переносит shop_order в секционированную по месяцам таблицу с теми же колонками и индексами."""
+    qn = connection.ops.quote_name
+    legacy = f'{ORDER_TABLE}_legacy'
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT conname FROM pg_constraint WHERE contype = 'f' "
+            "AND conrelid = %s::regclass AND confrelid = %s::regclass",
+            [ORDER_ITEM_TABLE, ORDER_TABLE])
+        for (constraint,) in cursor.fetchall():
+            cursor.execute(f"ALTER TABLE {qn(ORDER_ITEM_TABLE)} DROP CONSTRAINT {qn(constraint)}")
+
+        cursor.execute(f"SELECT min(created_at), coalesce(max(id), 0) FROM {qn(ORDER_TABLE)}")
+        oldest, last_id = cursor.fetchone()
+
+        cursor.execute(f"ALTER TABLE {qn(ORDER_TABLE)} RENAME TO {qn(legacy)}")
+        # Имена индексов уникальны в схеме: освобождаем их для новой таблицы
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s", [legacy])
+        for (index,) in cursor.fetchall():
+            cursor.execute(f"ALTER INDEX {qn(index)} RENAME TO {qn(index + '_legacy')}")
+
+        cursor.execute(
+            f"CREATE TABLE {qn(ORDER_TABLE)} (LIKE {qn(legacy)} INCLUDING DEFAULTS INCLUDING IDENTITY) "
+            f"PARTITION BY RANGE (created_at)")
+        cursor.execute(f"ALTER TABLE {qn(ORDER_TABLE)} ADD PRIMARY KEY (id, created_at)")
+        cursor.execute(
+            f"ALTER TABLE {qn(ORDER_TABLE)} ADD CONSTRAINT {qn(ORDER_TABLE + '_user_id_fk')} "
+            f"FOREIGN KEY (user_id) REFERENCES auth_user (id) DEFERRABLE INITIALLY DEFERRED")
+        cursor.execute(f"CREATE INDEX {qn(ORDER_TABLE + '_user_id')} ON {qn(ORDER_TABLE)} (user_id)")
+        cursor.execute(
+            f"CREATE INDEX shop_order_user_created_idx ON {qn(ORDER_TABLE)} (user_id, created_at DESC)")
+        cursor.execute(f"CREATE TABLE {qn(ORDER_TABLE + '_default')} PARTITION OF {qn(ORDER_TABLE)} DEFAULT")
+
+        month = month_start(oldest or timezone.now())
+        last = add_months(month_start(timezone.now()), months_ahead)
+        while month <= last:
+            create_partition(cursor, month)
+            month = add_months(month, 1)
+
+        cursor.execute(f"INSERT INTO {qn(ORDER_TABLE)} SELECT * FROM {qn(legacy)}")
+        cursor.execute(f"DROP TABLE {qn(legacy)}")
+        cursor.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), %s, true)", [ORDER_TABLE, max(last_id, 1)])
+
+
+def _copy_to_gzip(cursor, query, path):
+    with gzip.open(path, 'wb') as fh:
+        sql = f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)"
+        if hasattr(cursor, 'copy_expert'):  # psycopg2
+            cursor.copy_expert(sql, fh)
+        else:  # psycopg 3
+            with cursor.copy(sql) as copy:
+                for data in copy:
+                    fh.write(data)
+
+
+def archive_partitions(before, archive_dir=None):
+    """
+    Отсоединяет секции за месяцы раньше before. Если указан archive_dir, выгружает заказы и их позиции
+    в сжатые CSV, удаляет позиции и саму секцию; иначе оставляет отсоединённую таблицу в базе.
+    Возвращает имена обработанных секций.
+    """
+    qn = connection.ops.quote_name
+    processed = []
+    for month, name in list_partitions():
+        if month >= month_start(before):
+            break
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {qn(ORDER_TABLE)} DETACH PARTITION {qn(name)}")
+            if archive_dir is not None:
+                items_query = f"SELECT * FROM {qn(ORDER_ITEM_TABLE)} WHERE order_id IN (SELECT id FROM {qn(name)})"
+                _copy_to_gzip(cursor, f"SELECT * FROM {qn(name)}", os.path.join(archive_dir, f'{name}.csv.gz'))
+                _copy_to_gzip(cursor, items_query,
+                              os.path.join(archive_dir, f'{ORDER_ITEM_TABLE}_{name[len(ORDER_TABLE) + 1:]}.csv.gz'))
+                cursor.execute(f"DELETE FROM {qn(ORDER_ITEM_TABLE)} WHERE order_id IN (SELECT id FROM {qn(name)})")
+                cursor.execute(f"DROP TABLE {qn(name)}")
+        processed.append(name)
+    return processed
@@ -0,0 +1,113 @@
+import json
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from .models import Product, Category
+
+# Таблицы с меньшим числом строк можно сканировать последовательно: планировщик так и делает.
+LARGE_TABLE_ROWS = 10000
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE')
+
+
+class QueryPlanChecker:
+    """
+    Выполняет действия ProductViewSet, CartViewSet и OrderViewSet на текущей БД, запускает EXPLAIN для каждого
+    выполненного запроса и собирает последовательные сканирования больших таблиц с условием отбора (Filter).
+    Полное чтение таблицы без условия — осознанный выбор запроса, а не пропущенный индекс. Все изменения откатываются.
+
+    На маленькой базе планировщик предпочитает Seq Scan даже при наличии индекса. prefer_indexes=True запрещает
+    ему это (SET LOCAL enable_seqscan = off), и тогда Seq Scan в плане означает, что подходящего индекса нет:
+    так проверку можно запускать на тестовой базе с min_rows=0.
+
+    Работает только на PostgreSQL.
+    """
+
+    def __init__(self, min_rows=LARGE_TABLE_ROWS, prefer_indexes=False):
+        self.min_rows = min_rows
+        self.prefer_indexes = prefer_indexes
+
+    def get_requests(self, product, category):
+        product_detail = reverse('product-detail', args=[product.id])
+        return [
+            ('product-list', 'get', reverse('product-list'), None),
+            ('product-create', 'post', reverse('product-list'),
+             {'name': product.name, 'description': product.description, 'price': str(product.price),
+              'categories': [category.id]}),
+            ('product-retrieve', 'get', product_detail, None),
+            ('product-filter_by_price_category', 'get', reverse('product-filter-by-price-category'),
+             {'min_price': product.price, 'max_price': product.price, 'category_id': category.id}),
+            ('product-by_category', 'post', reverse('product-by-category'), {'category_id': category.id}),
+            ('product-update', 'patch', product_detail, {'price': str(product.price)}),
+            ('cart-create', 'post', reverse('cart-list'), {'product_id': product.id, 'quantity': 1}),
+            ('cart-list', 'get', reverse('cart-list'), None),
+            ('cart-update_item', 'put', reverse('cart-update-item'), {'product_id': product.id, 'quantity': 2}),
+            ('cart-remove_item', 'delete', reverse('cart-remove-item') + f'?product_id={product.id}', None),
+            ('cart-create', 'post', reverse('cart-list'), {'product_id': product.id, 'quantity': 1}),
+            ('order-create', 'post', reverse('order-list'), None),
+            ('order-list', 'get', reverse('order-list'), None),
+            ('product-destroy', 'delete', product_detail, None),
+        ]
+
+    def run(self):
+        """Возвращает список нарушений: (действие, таблица, оценка числа строк, SQL)."""
+        if connection.vendor != 'postgresql':
+            raise RuntimeError('Проверка планов запросов поддерживается только на PostgreSQL')
+
+        product = Product.objects.order_by('id').first()
+        category = Category.objects.filter(products__isnull=False).order_by('id').first()
+        if product is None or category is None:
+            raise RuntimeError('База данных не заполнена: нужны продукты с категориями')
+
+        violations = []
+        # APIClient ходит с Host: testserver
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']), transaction.atomic():
+            if self.prefer_indexes:
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            client = APIClient()
+            client.force_authenticate(User.objects.create_user(username='__query_plan_checker__'))
+            for name, method, url, data in self.get_requests(product, category):
+                with CaptureQueriesContext(connection) as captured:
+                    if method == 'get':
+                        client.get(url, data)
+                    else:
+                        getattr(client, method)(url, data, format='json')
+                for query in captured.captured_queries:
+                    violations.extend((name, table, rows, query['sql']) for table, rows in self.seq_scans(query['sql']))
+            transaction.set_rollback(True)
+        return violations
+
+    def seq_scans(self, sql):
+        """Последовательные сканирования с условием отбора в таблицах не меньше min_rows строк (по статистике pg_class)."""
+        if not sql.lstrip().upper().startswith(EXPLAINABLE):
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        found = []
+        for node in self._walk(plan[0]['Plan']):
+            if node.get('Node Type') == 'Seq Scan' and 'Filter' in node:
+                rows = self.table_rows(node['Relation Name'])
+                if rows >= self.min_rows:
+                    found.append((node['Relation Name'], rows))
+        return found
+
+    def _walk(self, node):
+        yield node
+        for child in node.get('Plans', ()):
+            yield from self._walk(child)
+
+    def table_rows(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+            row = cursor.fetchone()
+        # -1 — таблицу ещё ни разу не анализировали, размер неизвестен
+        return max(row[0], 0) if row else 0
@@ -0,0 +1,175 @@
+"""
+«Часто покупают вместе»: матрица совместных покупок товаров по истории OrderItem.
+
+Полный пересчёт читает историю диапазонами id заказов, из каждого диапазона строит разреженную матрицу
+заказы x товары и прибавляет её произведение на саму себя к общей матрице (NumPy/SciPy), так что в памяти
+никогда не лежит вся история; top-K выбирается сортировкой целых блоков строк. Без этих пакетов используется
+медленный вариант на чистом Python. Инкрементальное обновление добавляет совместные покупки из новых заказов
+к уже сохранённым top-K, поэтому между полными пересчётами пары за пределами top-K не учитываются.
+"""
+from collections import Counter, defaultdict
+from itertools import chain, combinations
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import OrderItem, ProductRecommendation, RollupCheckpoint
+from .rollups import SAFETY_LAG
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+CHECKPOINT = 'recommendations'
+TOP_K = 20
+BATCH_SIZE = 1000
+# Заказов в одном диапазоне id при чтении истории и строк матрицы в одном блоке при выборе top-K
+CHUNK_ORDERS = 10000
+ROW_BLOCK = 10000
+
+
+def _baskets(first_order_id, safety_lag):
+    """
+    История заказов после first_order_id, старше safety_lag: (последний id заказа, наибольший id товара, chunks).
+    chunks лениво читает по CHUNK_ORDERS id заказов и отдаёт списки пар (id заказа, id товара) без повторов.
+    """
+    cutoff = timezone.now() - safety_lag
+    history = OrderItem.objects.filter(order_id__gt=first_order_id, order__created_at__lte=cutoff)
+    bounds = history.aggregate(last_order_id=Max('order_id'), last_product_id=Max('product_id'))
+    last_order_id = bounds['last_order_id']
+    if last_order_id is None:
+        return None, None, []
+
+    def chunk(low):
+        return list(history.filter(order_id__gt=low, order_id__lte=min(low + CHUNK_ORDERS, last_order_id))
+                    .values_list('order_id', 'product_id').distinct().order_by('order_id'))
+
+    chunks = (chunk(low) for low in range(first_order_id, last_order_id, CHUNK_ORDERS))
+    return last_order_id, bounds['last_product_id'], chunks
+
+
+def _cooccurrence(chunks, size):
+    """Матрица совместных покупок size x size (CSR, индексы — id товаров), накопленная по диапазонам заказов."""
+    # Матрицы диапазонов складываются деревом, как разряды двоичного счётчика: сложение с накопленной суммой
+    # после каждого диапазона копировало бы её целиком и давало квадратичное время по длине истории
+    parts = []  # [(число диапазонов в части, матрица)], число диапазонов убывает к концу списка
+    for pairs in chunks:
+        if not pairs:
+            continue
+        pairs = np.array(pairs, dtype=np.int64)
+        orders, order_index = np.unique(pairs[:, 0], return_inverse=True)
+        basket = sparse.csr_matrix(
+            (np.ones(len(pairs), dtype=np.int32), (order_index, pairs[:, 1])),
+            shape=(len(orders), size),
+        )
+        parts.append((1, (basket.T @ basket).tocsr()))
+        while len(parts) > 1 and parts[-2][0] == parts[-1][0]:
+            (count, left), (_, right) = parts[-2:]
+            parts[-2:] = [(count * 2, left + right)]
+
+    total = sparse.csr_matrix((size, size), dtype=np.int32)
+    for _, part in parts:
+        total = total + part
+    total.setdiag(0)
+    total.eliminate_zeros()
+    return total
+
+
+def _top_k_sparse(chunks, size, k):
+    cooccurrence = _cooccurrence(chunks, size)
+    indptr, indices, data = cooccurrence.indptr, cooccurrence.indices, cooccurrence.data
+
+    top = {}
+    for start in range(0, size, ROW_BLOCK):
+        end = min(start + ROW_BLOCK, size)
+        low, high = indptr[start], indptr[end]
+        if low == high:
+            continue
+        rows = np.repeat(np.arange(start, end), np.diff(indptr[start:end + 1]))
+        columns, scores = indices[low:high], data[low:high]
+        # Внутри строки — по убыванию счёта, при равенстве по возрастанию id соседа
+        order = np.lexsort((columns, -scores, rows))
+        rows, columns, scores = rows[order], columns[order], scores[order]
+        if k is not None:
+            rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+            keep = rank < k
+            rows, columns, scores = rows[keep], columns[keep], scores[keep]
+        boundaries = np.flatnonzero(np.diff(rows)) + 1
+        for row_columns, row_scores, row in zip(np.split(columns, boundaries), np.split(scores, boundaries),
+                                                rows[np.r_[0, boundaries]]):
+            top[int(row)] = list(zip(row_columns.tolist(), row_scores.tolist()))
+    return top
+
+
+def _top_k_python(chunks, k):
+    baskets = defaultdict(set)
+    for order_id, product_id in chain.from_iterable(chunks):
+        baskets[order_id].add(product_id)
+    counts = defaultdict(Counter)
+    for items in baskets.values():
+        for a, b in combinations(sorted(items), 2):
+            counts[a][b] += 1
+            counts[b][a] += 1
+    return {product_id: neighbours.most_common(k) for product_id, neighbours in counts.items()}
+
+
+def cooccurrence_top_k(chunks, size, k=TOP_K):
+    """
+    {id товара: [(id соседа, число совместных заказов), ...]} — не больше k соседей по убыванию.
+    chunks — итерируемое списков пар (id заказа, id товара), один заказ целиком в одном списке;
+    size — наибольший id товара + 1.
+    """
+    if sparse is not None:
+        return _top_k_sparse(chunks, size, k)
+    return _top_k_python(chunks, k)
+
+
+def _save(top, replace=True):
+    rows = [
+        ProductRecommendation(product_id=product_id, recommended_id=recommended_id, score=score)
+        for product_id, neighbours in top.items()
+        for recommended_id, score in neighbours
+    ]
+    if replace:
+        ProductRecommendation.objects.filter(product_id__in=top.keys()).delete()
+    ProductRecommendation.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+def rebuild_recommendations(k=TOP_K, safety_lag=SAFETY_LAG):
+    """Пересчитывает рекомендации по всей истории заказов. Возвращает количество товаров с рекомендациями."""
+    with transaction.atomic():
+        checkpoint, _ = RollupCheckpoint.objects.select_for_update().get_or_create(name=CHECKPOINT)
+        last_order_id, last_product_id, chunks = _baskets(0, safety_lag)
+        top = cooccurrence_top_k(chunks, last_product_id + 1, k) if last_order_id is not None else {}
+        ProductRecommendation.objects.all().delete()
+        _save(top, replace=False)
+        if last_order_id is not None:
+            checkpoint.last_order_id = last_order_id
+            checkpoint.save(update_fields=['last_order_id'])
+    return len(top)
+
+
+def update_recommendations(k=TOP_K, safety_lag=SAFETY_LAG):
+    """Добавляет совместные покупки из заказов после контрольной точки. Возвращает количество обновлённых товаров."""
+    with transaction.atomic():
+        checkpoint, _ = RollupCheckpoint.objects.select_for_update().get_or_create(name=CHECKPOINT)
+        last_order_id, last_product_id, chunks = _baskets(checkpoint.last_order_id, safety_lag)
+        if last_order_id is None:
+            return 0
+        # Новые заказы дают полные счётчики для затронутых товаров, поэтому здесь top-K не обрезается
+        fresh = cooccurrence_top_k(chunks, last_product_id + 1, k=None)
+
+        merged = defaultdict(Counter)
+        for row in ProductRecommendation.objects.filter(product_id__in=fresh.keys()):
+            merged[row.product_id][row.recommended_id] = row.score
+        for product_id, neighbours in fresh.items():
+            for recommended_id, score in neighbours:
+                merged[product_id][recommended_id] += score
+
+        _save({product_id: counts.most_common(k) for product_id, counts in merged.items()})
+        checkpoint.last_order_id = last_order_id
+        checkpoint.save(update_fields=['last_order_id'])
+    return len(merged)
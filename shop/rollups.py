@@ -0,0 +1,89 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Sum, Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Order, OrderItem, ProductDailySales, CategoryDailySales, RollupCheckpoint
+
+CHECKPOINT = 'sales'
+BATCH_SIZE = 1000
+# Заказы моложе этого интервала не учитываются: транзакция с меньшим id могла ещё не зафиксироваться
+SAFETY_LAG = timedelta(seconds=60)
+
+
+def _accumulate(model, key_field, rows):
+    """Прибавляет строки {key_field, day, quantity, lines} к существующим сводкам модели."""
+    rows = list(rows)
+    if not rows:
+        return
+    keys = {(row[key_field], row['day']) for row in rows}
+    existing = {
+        (getattr(obj, key_field), obj.date): obj
+        for obj in model.objects.filter(
+            **{f'{key_field}__in': {key for key, _ in keys}},
+            date__in={day for _, day in keys},
+        )
+    }
+
+    to_create, to_update = [], []
+    for row in rows:
+        obj = existing.get((row[key_field], row['day']))
+        if obj is None:
+            to_create.append(model(**{key_field: row[key_field]}, date=row['day'],
+                                   quantity=row['quantity'], lines=row['lines']))
+        else:
+            obj.quantity += row['quantity']
+            obj.lines += row['lines']
+            to_update.append(obj)
+
+    model.objects.bulk_update(to_update, ['quantity', 'lines'], batch_size=BATCH_SIZE)
+    model.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+
+
+def _apply_orders(first_order_id, last_order_id):
+    items = (OrderItem.objects
+             .filter(order_id__gt=first_order_id, order_id__lte=last_order_id)
+             .annotate(day=TruncDate('order__created_at')))
+
+    _accumulate(ProductDailySales, 'product_id',
+                items.values('day', 'product_id').annotate(quantity=Sum('quantity'), lines=Count('id')))
+    _accumulate(CategoryDailySales, 'category_id',
+                items.filter(product__category_index__isnull=False)
+                .values('day', category_id=F('product__category_index__category_id'))
+                .annotate(quantity=Sum('quantity'), lines=Count('id')))
+
+
+def update_sales_rollups(batch_size=BATCH_SIZE, safety_lag=SAFETY_LAG):
+    """
+    Добавляет в сводки заказы, появившиеся после контрольной точки. Возвращает количество учтённых заказов.
+
+    Пачки берутся по id заказа; каждая пачка и сдвиг контрольной точки фиксируются одной транзакцией,
+    поэтому прерванный запуск можно просто повторить.
+    """
+    cutoff = timezone.now() - safety_lag
+    processed = 0
+    while True:
+        with transaction.atomic():
+            checkpoint, _ = RollupCheckpoint.objects.get_or_create(name=CHECKPOINT)
+            checkpoint = RollupCheckpoint.objects.select_for_update().get(pk=checkpoint.pk)
+
+            order_ids = list(Order.objects.filter(id__gt=checkpoint.last_order_id, created_at__lte=cutoff)
+                             .order_by('id').values_list('id', flat=True)[:batch_size])
+            if not order_ids:
+                return processed
+
+            _apply_orders(checkpoint.last_order_id, order_ids[-1])
+            checkpoint.last_order_id = order_ids[-1]
+            checkpoint.save(update_fields=['last_order_id'])
+            processed += len(order_ids)
+
+
+def rebuild_sales_rollups(batch_size=BATCH_SIZE, safety_lag=SAFETY_LAG):
+    """Удаляет сводки и пересчитывает их по всей истории заказов."""
+    with transaction.atomic():
+        ProductDailySales.objects.all().delete()
+        CategoryDailySales.objects.all().delete()
+        RollupCheckpoint.objects.update_or_create(name=CHECKPOINT, defaults={'last_order_id': 0})
+    return update_sales_rollups(batch_size, safety_lag)
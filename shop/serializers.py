@@ -1,4 +1,5 @@
 # shop/serializers.py
+from django.db.models import QuerySet
 from rest_framework import serializers
 from .models import Product, CartItem, Cart, Order, OrderItem, Category
 
@@ -44,6 +45,96 @@ class ProductSerializer(serializers.ModelSerializer):
         return rep
 
 
+class ProductProjection:
+    """
+    Быстрая сериализация продуктов для ?fields= и ?expand=categories: выбирает только нужные колонки
+    через values() и собирает ответ из словарей, не создавая экземпляры моделей.
+
+    Без expand категории отдаются списком идентификаторов, с expand=categories — деревьями предков,
+    как в ProductSerializer.
+    """
+    FIELDS = ['id', 'name', 'description', 'price', 'categories']
+    EXPANDABLE = ['categories']
+    price_field = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+    def __init__(self, fields=None, expand=None):
+        fields = fields or self.FIELDS
+        expand = expand or []
+        unknown = [name for name in fields if name not in self.FIELDS]
+        if unknown:
+            raise serializers.ValidationError({'fields': f'Неизвестные поля: {", ".join(unknown)}'})
+        unknown = [name for name in expand if name not in self.EXPANDABLE]
+        if unknown:
+            raise serializers.ValidationError({'expand': f'Нельзя раскрыть: {", ".join(unknown)}'})
+
+        self.fields = fields
+        self.expand_categories = 'categories' in expand
+        self.with_categories = 'categories' in fields or self.expand_categories
+
+    @classmethod
+    def from_query_params(cls, query_params):
+        """Возвращает проекцию по параметрам запроса или None, если ни fields, ни expand не переданы."""
+        fields = query_params.get('fields')
+        expand = query_params.get('expand')
+        if fields is None and expand is None:
+            return None
+        for name, value in (('fields', fields), ('expand', expand)):
+            if value is not None and not cls.split(value):
+                raise serializers.ValidationError({name: 'Пустой список'})
+        return cls(cls.split(fields), cls.split(expand))
+
+    @staticmethod
+    def split(value):
+        return [name.strip() for name in value.split(',') if name.strip()] if value else None
+
+    def serialize(self, queryset):
+        """Сериализует QuerySet продуктов или уже выбранную страницу (список экземпляров) в порядке следования."""
+        columns = [name for name in self.fields if name != 'categories']
+        values = ['id'] + [name for name in columns if name != 'id']
+        if isinstance(queryset, QuerySet):
+            rows = list(queryset.values(*values))
+        else:
+            ids = [product.pk for product in queryset]
+            by_id = {row['id']: row for row in Product.objects.filter(id__in=ids).values(*values)}
+            rows = [by_id[pk] for pk in ids if pk in by_id]
+        categories = self.get_categories([row['id'] for row in rows]) if self.with_categories else {}
+
+        data = []
+        for row in rows:
+            item = {name: row[name] for name in columns}
+            if 'price' in item:
+                item['price'] = self.price_field.to_representation(item['price'])
+            if self.with_categories:
+                item['categories'] = categories.get(row['id'], [])
+            data.append(item)
+        return data
+
+    def get_categories(self, product_ids):
+        """Категории продуктов двумя-тремя запросами: {id продукта: [id или дерево категории, ...]}."""
+        # Порядок как у product.categories.all(): менеджер MPTT сортирует по (tree_id, lft)
+        links = (Product.categories.through.objects.filter(product_id__in=product_ids)
+                 .order_by('category__tree_id', 'category__lft'))
+        links = list(links.values_list('product_id', 'category_id'))
+
+        nodes = {}
+        if self.expand_categories:
+            tree_ids = Category.objects.filter(id__in={category_id for _, category_id in links}).values('tree_id')
+            nodes = {row[0]: row for row in Category.objects.filter(tree_id__in=tree_ids).values_list(
+                'id', 'name', 'parent_id')}
+
+        categories = {}
+        for product_id, category_id in links:
+            value = self.category_tree(category_id, nodes) if self.expand_categories else category_id
+            categories.setdefault(product_id, []).append(value)
+        return categories
+
+    def category_tree(self, category_id, nodes):
+        """Повторяет формат CategoryTreeSerializer: категория с вложенной цепочкой родителей."""
+        category_id, name, parent_id = nodes[category_id]
+        parent = self.category_tree(parent_id, nodes) if parent_id is not None else None
+        return {'id': category_id, 'name': name, 'parent': parent}
+
+
 class CartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
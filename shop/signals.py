@@ -0,0 +1,67 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from mptt.signals import node_moved
+
+from . import cache
+from .category_index import rebuild_product_index, products_in_subtree
+from .models import Category, Product
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def product_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Обновляет индекс предков категорий и кэш продуктов при изменении связей продукт-категория."""
+    if reverse and action == 'pre_clear':
+        instance._index_product_ids = set(instance.products.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        product_ids = [instance.pk]
+    elif action == 'post_clear':
+        product_ids = getattr(instance, '_index_product_ids', ())
+    else:
+        product_ids = pk_set
+    rebuild_product_index(product_ids)
+    # Сброс кэша — после фиксации: иначе параллельный запрос успеет положить в кэш ещё старые данные
+    transaction.on_commit(partial(cache.invalidate_products, list(product_ids)))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, **kwargs):
+    transaction.on_commit(partial(cache.invalidate_products, [instance.pk]))
+
+
+@receiver(node_moved, sender=Category)
+def category_moved(sender, instance, **kwargs):
+    """При перемещении категории пересчитывает индекс для всех продуктов её поддерева."""
+    # Из Category.save() сигнал приходит до записи нового parent_id, поэтому пересчёт откладывается до post_save;
+    # из TreeManager.move_node() (передаёт position) узел к этому моменту уже сохранён.
+    if 'position' in kwargs:
+        rebuild_product_index(products_in_subtree(instance))
+    else:
+        instance._index_moved = True
+
+
+@receiver(post_save, sender=Category)
+def category_post_save(sender, instance, **kwargs):
+    if instance.__dict__.pop('_index_moved', False):
+        rebuild_product_index(products_in_subtree(instance))
+    transaction.on_commit(cache.bump_category_version)
+
+
+@receiver(pre_delete, sender=Category)
+def category_pre_delete(sender, instance, **kwargs):
+    instance._index_product_ids = products_in_subtree(instance)
+
+
+@receiver(post_delete, sender=Category)
+def category_post_delete(sender, instance, **kwargs):
+    """После удаления категории убирает её предков из индекса затронутых продуктов."""
+    product_ids = getattr(instance, '_index_product_ids', set())
+    rebuild_product_index(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+    transaction.on_commit(cache.bump_category_version)
@@ -0,0 +1,82 @@
+"""
+Операции над целым поддеревом категорий несколькими SQL-запросами, без загрузки узлов и продуктов в Python.
+"""
+from decimal import Decimal
+
+from django.db import DataError, connection, transaction
+from django.db.models import F, Max, Value
+from django.db.models.functions import Greatest, Round
+
+from . import cache
+from .category_index import rebuild_product_index, BATCH_SIZE
+from .models import Category, Product, ProductCategoryIndex, CategoryDailySales
+
+
+def delete_subtree(category):
+    """
+    Удаляет категорию со всеми подкатегориями, их связи с продуктами и строки индекса и сводок.
+    Сами продукты остаются. Возвращает количество удалённых категорий.
+    """
+    qn = connection.ops.quote_name
+    with transaction.atomic():
+        # Актуальные границы: экземпляр мог устареть после изменений дерева
+        category = Category.objects.select_for_update().get(pk=category.pk)
+        tree_id, left, right = category.tree_id, category.lft, category.rght
+        width = right - left + 1
+        subtree = Category.objects.filter(tree_id=tree_id, lft__gte=left, rght__lte=right)
+
+        affected = list(ProductCategoryIndex.objects.filter(category=category).values_list('product_id', flat=True))
+        Product.categories.through.objects.filter(category__in=subtree).delete()
+        ProductCategoryIndex.objects.filter(category__in=subtree).delete()
+        CategoryDailySales.objects.filter(category__in=subtree).delete()
+
+        # QuerySet.delete() загрузил бы каждую категорию ради сигналов, поэтому удаляем одним запросом
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {qn(Category._meta.db_table)} WHERE tree_id = %s AND lft >= %s AND rght <= %s",
+                [tree_id, left, right])
+            deleted = cursor.rowcount
+
+        # Закрываем образовавшийся промежуток в нумерации MPTT
+        Category.objects.filter(tree_id=tree_id, lft__gt=right).update(lft=F('lft') - width)
+        Category.objects.filter(tree_id=tree_id, rght__gt=right).update(rght=F('rght') - width)
+
+        # Продукты могли лишиться предков выше удалённого поддерева
+        for start in range(0, len(affected), BATCH_SIZE):
+            rebuild_product_index(affected[start:start + BATCH_SIZE])
+        transaction.on_commit(cache.bump_category_version)
+    return deleted
+
+
+def _max_price():
+    field = Product._meta.get_field('price')
+    return Decimal(10) ** (field.max_digits - field.decimal_places) - Decimal(1).scaleb(-field.decimal_places)
+
+
+def reprice_subtree(category, percent=None, amount=None):
+    """
+    Меняет цены всех продуктов категории и её подкатегорий одним UPDATE: на percent процентов
+    или на amount денежных единиц. Цена не опускается ниже нуля. Возвращает количество изменённых продуктов.
+    Бросает ValueError, если новая цена какого-либо продукта не помещается в поле price.
+    """
+    if (percent is None) == (amount is None):
+        raise ValueError('Нужно указать ровно одно из percent и amount')
+    if percent is not None:
+        new_price = Round(F('price') * (1 + Decimal(percent) / 100), 2)
+    else:
+        new_price = F('price') + Decimal(amount)
+
+    with transaction.atomic():
+        products = Product.objects.filter(category_index__category_id=category.pk)
+        # Переполнение numeric(10, 2) оборвало бы UPDATE ошибкой базы; проверяем заранее одним агрегатом
+        highest, limit = products.aggregate(highest=Max(new_price))['highest'], _max_price()
+        if highest is not None and highest > limit:
+            raise ValueError(f'Новая цена {highest} превышает максимально допустимую {limit}')
+        try:
+            updated = products.update(price=Greatest(new_price, Value(Decimal('0.00'))))
+        except DataError:
+            # Цены успели вырасти после проверки
+            raise ValueError(f'Новая цена превышает максимально допустимую {limit}')
+        # Версия общая для всех закэшированных продуктов: сбрасывать её дешевле, чем удалять сотни тысяч ключей
+        transaction.on_commit(cache.bump_category_version)
+    return updated
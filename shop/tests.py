@@ -1,8 +1,41 @@
+import gzip
+import io
+import os
+import random
+import tempfile
+import threading
+import time
+from importlib import import_module
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.apps import apps
+from django.core.cache import cache as django_cache
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.permissions import BasePermission
+from rest_framework.test import APIClient, APITestCase
 from django.contrib.auth.models import User
-from .models import Product, Cart, CartItem, Order, OrderItem, Category
+from .models import (Product, Cart, CartItem, Order, OrderItem, Category, ProductCategoryIndex, OutboxEvent,
+                     ProductDailySales, CategoryDailySales, ProductRecommendation, StockShard)
+from .outbox import OutboxDispatcher, purge_events
+from .renderers import FastJSONRenderer, FastJSONParser
+from .serializers import ProductProjection
+from . import cache as product_cache
+from . import inventory
+from .subtree import reprice_subtree
+from . import partitions
+from .partitions import add_months, partition_name
+from .recommendations import rebuild_recommendations, update_recommendations, _top_k_python, _top_k_sparse, sparse
+from .rollups import update_sales_rollups
+from .query_plans import QueryPlanChecker
+from .views import ProductViewSet
 
 
 class ProductViewSetTestCase(APITestCase):
@@ -85,3 +118,710 @@ class CartViewSetTestCase(APITestCase):
         data = {'product_id': self.product.id, 'quantity': 3}
         response = self.client.put(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ProductCategoryIndexTestCase(APITestCase):
+    def setUp(self):
+        self.root = Category.objects.create(name='Electronics')
+        self.child = Category.objects.create(name='Laptops', parent=self.root)
+        self.other = Category.objects.create(name='Books')
+        self.product = Product.objects.create(name='Laptop', description='A powerful laptop', price=1200)
+        self.product.categories.set([self.child])
+
+    def indexed_categories(self):
+        return set(ProductCategoryIndex.objects.filter(product=self.product).values_list('category_id', flat=True))
+
+    def test_index_contains_ancestors(self):
+        self.assertEqual(self.indexed_categories(), {self.root.id, self.child.id})
+
+    def test_index_follows_category_move(self):
+        self.child.parent = self.other
+        self.child.save()
+        self.assertEqual(self.indexed_categories(), {self.other.id, self.child.id})
+
+    def test_index_after_category_delete(self):
+        self.product.categories.add(self.other)
+        self.root.delete()
+        self.assertEqual(self.indexed_categories(), {self.other.id})
+
+    def test_by_category_uses_subtree(self):
+        url = reverse('product-by-category')
+        response = self.client.post(url, {'category_id': self.root.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data], [self.product.id])
+
+    def test_index_follows_move_to(self):
+        self.child.move_to(self.other, 'last-child')
+        self.assertEqual(self.indexed_categories(), {self.other.id, self.child.id})
+
+    def test_migration_populates_index(self):
+        migration = import_module('shop.migrations.0004_product_category_index')
+        ProductCategoryIndex.objects.all().delete()
+        migration.populate_category_index(apps, None)
+        self.assertEqual(self.indexed_categories(), {self.root.id, self.child.id})
+
+
+@skipUnless(connection.vendor == 'postgresql', 'EXPLAIN-проверка работает только на PostgreSQL')
+class QueryPlanCheckerTestCase(APITestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Electronics')
+        product = Product.objects.create(name='Laptop', description='A powerful laptop', price=1200)
+        product.categories.set([category])
+
+    def test_no_seq_scans_on_large_tables(self):
+        # Таблицы в тесте крошечные: min_rows=0 проверяет все, а prefer_indexes не даёт планировщику
+        # выбрать Seq Scan там, где индекс есть
+        self.assertEqual(QueryPlanChecker(min_rows=0, prefer_indexes=True).run(), [])
+
+    def test_missing_index_detected(self):
+        table = ProductCategoryIndex._meta.db_table
+        with connection.cursor() as cursor:
+            # ALTER TABLE невозможен, пока в транзакции есть отложенные проверки внешних ключей
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            for name, info in connection.introspection.get_constraints(cursor, table).items():
+                if info['unique'] and not info['primary_key']:
+                    cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT {name}')
+                elif info['index'] and not info['primary_key']:
+                    cursor.execute(f'DROP INDEX {name}')
+
+        violations = QueryPlanChecker(min_rows=0, prefer_indexes=True).run()
+        self.assertIn(('product-by_category', table), [(name, found) for name, found, _, _ in violations])
+
+
+handled_events = []
+
+
+def record_event(event):
+    handled_events.append(event.payload['order_id'])
+
+
+def failing_handler(event):
+    raise RuntimeError('ERP недоступна')
+
+
+class OrderOutboxTestCase(APITestCase):
+    def setUp(self):
+        handled_events.clear()
+        self.user = User.objects.create_user(username='orderuser', password='12345')
+        self.client.login(username='orderuser', password='12345')
+        product = Product.objects.create(name='Tablet', description='An Android tablet', price=300)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=product, quantity=2)
+
+    def create_order(self):
+        response = self.client.post(reverse('order-list'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def test_create_order_writes_outbox_event(self):
+        order_id = self.create_order()
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.event_type, 'order.created')
+        self.assertEqual(event.payload['order_id'], order_id)
+        self.assertIsNone(event.processed_at)
+
+    @override_settings(SHOP_OUTBOX_HANDLERS={'order.created': ['shop.tests.record_event']})
+    def test_dispatcher_processes_events(self):
+        order_id = self.create_order()
+        dispatcher = OutboxDispatcher()
+        self.assertEqual(dispatcher.dispatch_batch(), 1)
+        self.assertEqual(handled_events, [order_id])
+        self.assertIsNotNone(OutboxEvent.objects.get().processed_at)
+        self.assertEqual(dispatcher.dispatch_batch(), 0)
+
+    @override_settings(SHOP_OUTBOX_HANDLERS={'order.created': ['shop.tests.failing_handler']})
+    def test_dispatcher_retries_then_fails(self):
+        self.create_order()
+        dispatcher = OutboxDispatcher(max_attempts=2)
+        dispatcher.dispatch_batch()
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.attempts, 1)
+        self.assertGreater(event.available_at, event.created_at)
+
+        OutboxEvent.objects.update(available_at=event.created_at)
+        dispatcher.dispatch_batch()
+        self.assertIsNotNone(OutboxEvent.objects.get().failed_at)
+        self.assertEqual(dispatcher.stats['failed'], 1)
+
+    def test_purge_old_events(self):
+        now = timezone.now()
+        pending = OutboxEvent.objects.create(event_type='order.created', payload={})
+        recent = OutboxEvent.objects.create(event_type='order.created', payload={}, processed_at=now)
+        OutboxEvent.objects.create(event_type='order.created', payload={}, processed_at=now - timedelta(days=8))
+        OutboxEvent.objects.create(event_type='order.created', payload={}, failed_at=now - timedelta(days=8))
+
+        self.assertEqual(purge_events(batch_size=1), 2)
+        self.assertEqual(set(OutboxEvent.objects.values_list('id', flat=True)), {pending.id, recent.id})
+
+
+class OrderHistoryTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='orderuser', password='12345')
+        self.client.login(username='orderuser', password='12345')
+        self.order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=self.order, product=Product.objects.create(
+            name='Tablet', description='An Android tablet', price=300), quantity=2)
+        old_order = Order.objects.create(user=self.user)
+        Order.objects.filter(id=old_order.id).update(created_at=timezone.now() - timedelta(days=400))
+
+    def test_order_history(self):
+        response = self.client.get(reverse('order-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([order['id'] for order in response.data], [self.order.id])
+        self.assertEqual(len(response.data[0]['items']), 1)
+
+    def test_days_clamped(self):
+        for days in (-999999999, 0, 10 ** 12):
+            response = self.client.get(reverse('order-list'), {'days': days})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+        response = self.client.get(reverse('order-list'), {'days': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class FastJSONRendererTestCase(APITestCase):
+    def test_decimal_rendered_as_string(self):
+        body = FastJSONRenderer().render({'price': Decimal('1200.10'), 'name': 'Laptop'})
+        self.assertEqual(FastJSONParser().parse(io.BytesIO(body)), {'price': '1200.10', 'name': 'Laptop'})
+
+    def test_product_list_response(self):
+        category = Category.objects.create(name='Electronics')
+        product = Product.objects.create(name='Laptop', description='A powerful laptop', price=1200)
+        product.categories.set([category])
+        response = self.client.get(reverse('product-list'))
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.json()[0]['price'], '1200.00')
+
+
+class ProductProjectionTestCase(APITestCase):
+    def setUp(self):
+        self.root = Category.objects.create(name='Electronics')
+        self.child = Category.objects.create(name='Laptops', parent=self.root)
+        self.product = Product.objects.create(name='Laptop', description='A powerful laptop', price=1200)
+        self.product.categories.set([self.child])
+
+    def test_list_sparse_fields(self):
+        response = self.client.get(reverse('product-list'), {'fields': 'id,name,price'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), [{'id': self.product.id, 'name': 'Laptop', 'price': '1200.00'}])
+
+    def test_category_ids_and_expand(self):
+        url = reverse('product-detail', args=[self.product.id])
+        response = self.client.get(url, {'fields': 'id,categories'})
+        self.assertEqual(response.json(), {'id': self.product.id, 'categories': [self.child.id]})
+
+        full = self.client.get(url).json()
+        expanded = self.client.get(url, {'expand': 'categories'}).json()
+        self.assertEqual(expanded, full)
+
+    def test_category_order_matches_full_serializer(self):
+        zeta = Category.objects.create(name='Zeta')
+        alpha = Category.objects.create(name='Alpha')
+        self.product.categories.add(zeta)
+        self.product.categories.add(alpha)
+        url = reverse('product-detail', args=[self.product.id])
+        full = self.client.get(url).json()
+        self.assertEqual([category['name'] for category in full['categories']], ['Alpha', 'Laptops', 'Zeta'])
+        self.assertEqual(self.client.get(url, {'expand': 'categories'}).json(), full)
+        self.assertEqual(self.client.get(reverse('product-list'), {'ids': self.product.id}).json()['results'], [full])
+
+    def test_unknown_field(self):
+        response = self.client.get(reverse('product-list'), {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_empty_projection_params(self):
+        for params in ({'fields': ''}, {'fields': ' , '}, {'expand': ''}):
+            response = self.client.get(reverse('product-list'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_retrieve_missing_product(self):
+        response = self.client.get(reverse('product-detail', args=[self.product.id + 100]), {'fields': 'id'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse('product-detail', args=['abc']), {'fields': 'id'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_retrieve_checks_object_permissions(self):
+        class DenyObject(BasePermission):
+            def has_object_permission(self, request, view, obj):
+                return False
+
+        with patch.object(ProductViewSet, 'permission_classes', [DenyObject]):
+            response = self.client.get(reverse('product-detail', args=[self.product.id]), {'fields': 'id'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class SalesRollupTestCase(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='12345')
+        self.client.login(username='admin', password='12345')
+        self.root = Category.objects.create(name='Electronics')
+        self.child = Category.objects.create(name='Laptops', parent=self.root)
+        self.product = Product.objects.create(name='Laptop', description='A powerful laptop', price=1200)
+        self.product.categories.set([self.child])
+        for quantity in (1, 2):
+            order = Order.objects.create(user=self.admin)
+            OrderItem.objects.create(order=order, product=self.product, quantity=quantity)
+
+    def test_incremental_update(self):
+        self.assertEqual(update_sales_rollups(safety_lag=timedelta(0)), 2)
+        order = Order.objects.create(user=self.admin)
+        OrderItem.objects.create(order=order, product=self.product, quantity=4)
+        self.assertEqual(update_sales_rollups(safety_lag=timedelta(0)), 1)
+
+        self.assertEqual(ProductDailySales.objects.get(product=self.product).quantity, 7)
+        self.assertEqual(CategoryDailySales.objects.get(category=self.root).quantity, 7)
+        self.assertEqual(CategoryDailySales.objects.get(category=self.child).lines, 3)
+
+    def test_category_report(self):
+        update_sales_rollups(safety_lag=timedelta(0))
+        today = timezone.now().date().isoformat()
+        response = self.client.get(reverse('report-categories'), {'date_from': today, 'date_to': today,
+                                                                   'category_id': self.root.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [{'category_id': self.root.id, 'quantity': 3, 'lines': 2}])
+
+    def test_report_requires_period(self):
+        response = self.client.get(reverse('report-products'), {'date_from': '2024-02-30'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_report_validates_key_and_limit(self):
+        update_sales_rollups(safety_lag=timedelta(0))
+        today = timezone.now().date().isoformat()
+        period = {'date_from': today, 'date_to': today}
+        response = self.client.get(reverse('report-products'), {**period, 'product_id': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('report-categories'), {**period, 'category_id': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('report-products'), {**period, 'limit': -1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class OrderPartitionHelpersTestCase(APITestCase):
+    def test_month_arithmetic(self):
+        self.assertEqual(add_months(date(2024, 11, 1), 3), date(2025, 2, 1))
+        self.assertEqual(add_months(date(2024, 1, 1), -1), date(2023, 12, 1))
+        self.assertEqual(partition_name(date(2024, 3, 1)), 'shop_order_p202403')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Секционирование работает только на PostgreSQL')
+class OrderPartitioningTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='partitioned', password='12345')
+        self.client.login(username='partitioned', password='12345')
+        self.product = Product.objects.create(name='Laptop', description='A powerful laptop', price=1200)
+        self.this_month = partitions.month_start(timezone.now())
+        self.old_month = add_months(self.this_month, -14)
+        self.old_order = self.place_order()
+        Order.objects.filter(pk=self.old_order.pk).update(
+            created_at=timezone.now().replace(year=self.old_month.year, month=self.old_month.month, day=15))
+        self.recent_order = self.place_order()
+        with connection.cursor() as cursor:
+            # ALTER TABLE невозможен, пока в транзакции есть отложенные проверки внешних ключей
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        partitions.convert_to_partitioned(months_ahead=2)
+
+    def place_order(self):
+        order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=order, product=self.product, quantity=1)
+        return order
+
+    def months(self):
+        return [month for month, _ in partitions.list_partitions()]
+
+    def test_convert_keeps_orders_and_creates_partitions(self):
+        self.assertTrue(partitions.is_partitioned())
+        self.assertEqual(self.months(), [add_months(self.old_month, n) for n in range(17)])
+        self.assertEqual(set(Order.objects.values_list('id', flat=True)), {self.old_order.id, self.recent_order.id})
+
+        order = self.place_order()
+        self.assertGreater(order.id, self.recent_order.id)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {partition_name(self.this_month)}')
+            self.assertEqual(cursor.fetchone()[0], 2)
+
+        partitions.ensure_partitions(months_ahead=4)
+        self.assertEqual(self.months()[-1], add_months(self.this_month, 4))
+
+    def test_history_prunes_old_partitions(self):
+        response = self.client.get(reverse('order-list'), {'days': 30})
+        self.assertEqual([order['id'] for order in response.data], [self.recent_order.id])
+
+        since = timezone.now() - timedelta(days=30)
+        plan = Order.objects.filter(user=self.user, created_at__gte=since).explain()
+        self.assertIn(partition_name(self.this_month), plan)
+        self.assertNotIn(partition_name(self.old_month), plan)
+
+    def test_detach_and_archive(self):
+        self.assertEqual(partitions.archive_partitions(add_months(self.old_month, 1)), [partition_name(self.old_month)])
+        self.assertNotIn(self.old_month, self.months())
+        self.assertFalse(Order.objects.filter(pk=self.old_order.pk).exists())
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT id FROM {partition_name(self.old_month)}')
+            self.assertEqual(cursor.fetchall(), [(self.old_order.id,)])
+            # Отсоединённая секция снова подключается, после чего её можно архивировать в файлы
+            cursor.execute(f"ALTER TABLE shop_order ATTACH PARTITION {partition_name(self.old_month)} "
+                           f"FOR VALUES FROM ('{self.old_month}') TO ('{add_months(self.old_month, 1)}')")
+
+        with tempfile.TemporaryDirectory() as archive_dir:
+            archived = partitions.archive_partitions(add_months(self.this_month, -1), archive_dir)
+            self.assertEqual(archived, [partition_name(add_months(self.old_month, n)) for n in range(13)])
+            with gzip.open(os.path.join(archive_dir, f'{partition_name(self.old_month)}.csv.gz'), 'rt') as fh:
+                self.assertEqual(len(fh.read().splitlines()), 2)
+            items_file = f'shop_orderitem_p{self.old_month:%Y%m}.csv.gz'
+            self.assertIn(items_file, os.listdir(archive_dir))
+
+        self.assertEqual(list(Order.objects.values_list('id', flat=True)), [self.recent_order.id])
+        self.assertFalse(OrderItem.objects.filter(order_id=self.old_order.id).exists())
+        self.assertEqual(self.months()[0], add_months(self.this_month, -1))
+
+
+class RecommendationTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='12345')
+        self.laptop, self.mouse, self.bag = [
+            Product.objects.create(name=name, description=name, price=100) for name in ('Laptop', 'Mouse', 'Bag')]
+        self.place_order(self.laptop, self.mouse)
+        self.place_order(self.laptop, self.mouse, self.bag)
+
+    def place_order(self, *products):
+        order = Order.objects.create(user=self.user)
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=product, quantity=1) for product in products])
+
+    @skipUnless(sparse is not None, 'Нужны numpy и scipy')
+    def test_sparse_and_python_paths_match(self):
+        chunks = [[(1, self.laptop.id), (1, self.mouse.id)], [(2, self.laptop.id), (2, self.mouse.id), (2, self.bag.id)]]
+        for k in (1, 2, None):
+            self.assertEqual(_top_k_sparse(chunks, self.bag.id + 1, k), _top_k_python(chunks, k))
+
+    @skipUnless(sparse is not None, 'Нужны numpy и scipy')
+    def test_sparse_many_chunks(self):
+        rng = random.Random(0)
+        chunks, order_id = [], 0
+        for _ in range(150):
+            pairs = []
+            for _ in range(rng.randint(0, 20)):
+                order_id += 1
+                pairs.extend((order_id, product_id) for product_id in sorted(rng.sample(range(60), rng.randint(1, 6))))
+            chunks.append(pairs)
+
+        def ranked(top):
+            return {product_id: sorted(neighbours, key=lambda item: (-item[1], item[0]))
+                    for product_id, neighbours in top.items()}
+        expected = ranked(_top_k_python(chunks, None))
+        self.assertEqual(_top_k_sparse(chunks, 60, None), expected)
+        self.assertEqual(_top_k_sparse(chunks, 60, 5), {key: value[:5] for key, value in expected.items()})
+
+    @patch('shop.recommendations.CHUNK_ORDERS', 1)
+    def test_rebuild_and_incremental_update(self):
+        rebuild_recommendations(safety_lag=timedelta(0))
+        self.place_order(self.laptop, self.bag)
+        self.place_order(self.laptop, self.bag)
+        update_recommendations(safety_lag=timedelta(0))
+
+        scores = dict(ProductRecommendation.objects.filter(product=self.laptop).values_list('recommended_id', 'score'))
+        self.assertEqual(scores, {self.mouse.id: 2, self.bag.id: 3})
+
+    def test_recommendations_endpoint(self):
+        rebuild_recommendations(safety_lag=timedelta(0))
+        response = self.client.get(reverse('product-recommendations', args=[self.mouse.id]), {'limit': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [{'id': self.laptop.id, 'name': 'Laptop', 'price': '100.00', 'score': 2}])
+
+        response = self.client.get(reverse('product-recommendations', args=[self.mouse.id]), {'limit': -1})
+        self.assertEqual(len(response.data), 1)
+        for pk in ('abc', self.bag.id + 100):
+            response = self.client.get(reverse('product-recommendations', args=[pk]))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class AdminChangelistTestCase(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='12345')
+        self.client.login(username='admin', password='12345')
+        category = Category.objects.create(name='Electronics')
+        product = Product.objects.create(name='Laptop', description='A powerful laptop', price=1200)
+        product.categories.set([category])
+        cart = Cart.objects.create(user=self.admin)
+        CartItem.objects.create(cart=cart, product=product)
+        self.order = Order.objects.create(user=self.admin)
+        OrderItem.objects.create(order=self.order, product=product, quantity=1)
+
+    def test_changelists(self):
+        for model in ('category', 'product', 'cart', 'cartitem', 'order', 'orderitem'):
+            for params in ({}, {'q': 'Lap'}):
+                response = self.client.get(reverse(f'admin:shop_{model}_changelist'), params)
+                self.assertEqual(response.status_code, status.HTTP_200_OK, model)
+
+    def test_search(self):
+        cases = [('product', 'Lap', 1), ('product', 'lap', 1), ('product', 'abc', 0), ('category', 'elec', 1),
+                 ('cart', 'ADMIN', 1), ('cart', 'adm', 0), ('order', 'abc', 0), ('order', str(self.order.id), 1),
+                 ('order', 'admin', 1)]
+        for model, term, expected in cases:
+            response = self.client.get(reverse(f'admin:shop_{model}_changelist'), {'q': term})
+            self.assertEqual(response.status_code, status.HTTP_200_OK, (model, term))
+            self.assertEqual(response.context['cl'].result_count, expected, (model, term))
+
+    @skipUnless(connection.vendor == 'postgresql', 'EXPLAIN-проверка работает только на PostgreSQL')
+    def test_search_lookups_use_indexes(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        # Те же сравнения, что строит поиск админки для '^name' и '=user__username'
+        for queryset in (Product.objects.filter(name__istartswith='lap'),
+                         Category.objects.filter(name__istartswith='elec'),
+                         User.objects.filter(username__iexact='admin')):
+            self.assertRegex(queryset.explain(), r'Index Cond: .*upper', queryset.model.__name__)
+
+    def test_inline_rows_do_not_query_products(self):
+        url = reverse('admin:shop_order_change', args=[self.order.id])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as single:
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=self.order, product=Product.objects.create(name=f'Item {n}', description='', price=1),
+                      quantity=1) for n in range(5)])
+        with self.assertNumQueries(len(single)):
+            self.client.get(url)
+
+
+class StockReservationTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='stockuser', password='12345')
+        self.client.login(username='stockuser', password='12345')
+        self.product = Product.objects.create(name='Phone', description='Limited edition', price=500, stock=3)
+
+    def add_to_cart(self, quantity):
+        return self.client.post(reverse('cart-list'), {'product_id': self.product.id, 'quantity': quantity},
+                                format='json')
+
+    def stock(self):
+        return inventory.available(self.product)
+
+    def test_cart_reserves_and_checkout_consumes(self):
+        self.assertEqual(self.add_to_cart(2).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.stock(), 1)
+        self.assertEqual(self.add_to_cart(2).status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.client.post(reverse('order-list'), format='json').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.stock(), 1)
+
+    def test_remove_item_releases_stock(self):
+        self.add_to_cart(3)
+        self.client.delete(reverse('cart-remove-item') + f'?product_id={self.product.id}')
+        self.assertEqual(self.stock(), 3)
+
+    def test_expired_reservation_released_then_rechecked_at_checkout(self):
+        self.add_to_cart(2)
+        CartItem.objects.update(reserved_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(inventory.expire_reservations(), 1)
+        self.assertEqual(self.stock(), 3)
+
+        Product.objects.filter(pk=self.product.pk).update(stock=1)
+        response = self.client.post(reverse('order-list'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.stock(), 1)
+
+    def test_product_update_keeps_concurrent_reservation(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        inventory.reserve(self.product, 2)
+
+        stale.name = 'Phone X'
+        stale.save()
+        response = self.client.patch(reverse('product-detail', args=[self.product.id]), {'price': 450}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.stock(), 1)
+        self.assertEqual(Product.objects.values_list('name', 'price').get(pk=self.product.pk), ('Phone X', 450))
+
+    def test_sharded_stock(self):
+        inventory.set_stock(self.product, 5, shards=2)
+        self.assertEqual(sorted(StockShard.objects.values_list('quantity', flat=True)), [2, 3])
+        inventory.reserve(self.product, 4)
+        self.assertEqual(self.stock(), 1)
+        with self.assertRaises(inventory.OutOfStock):
+            inventory.reserve(self.product, 2)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Нужны параллельные соединения PostgreSQL')
+class ConcurrentCheckoutTestCase(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='racer', password='12345')
+        self.product = Product.objects.create(name='Phone', description='Limited edition', price=500, stock=5)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+
+    def test_same_cart_checked_out_once(self):
+        first_inside = threading.Event()
+        checkout = inventory.checkout
+
+        def slow_checkout(cart_items):
+            checkout(cart_items)
+            first_inside.set()
+            time.sleep(0.5)
+
+        statuses = []
+
+        def buyer():
+            client = APIClient()
+            client.force_authenticate(self.user)
+            try:
+                statuses.append(client.post(reverse('order-list'), format='json').status_code)
+            finally:
+                connection.close()
+
+        with patch('shop.inventory.checkout', side_effect=slow_checkout):
+            first = threading.Thread(target=buyer)
+            first.start()
+            self.assertTrue(first_inside.wait(5))
+            second = threading.Thread(target=buyer)
+            second.start()
+            first.join()
+            second.join()
+
+        self.assertEqual(sorted(statuses), [status.HTTP_201_CREATED, status.HTTP_400_BAD_REQUEST])
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(inventory.available(self.product), 3)
+
+
+class ProductMultiGetTestCase(APITestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.category = Category.objects.create(name='Electronics')
+        self.laptop = Product.objects.create(name='Laptop', description='A powerful laptop', price=1200)
+        self.phone = Product.objects.create(name='Phone', description='A smartphone', price=700)
+        for product in (self.laptop, self.phone):
+            product.categories.set([self.category])
+
+    def multi_get(self, ids):
+        return self.client.get(reverse('product-list'), {'ids': ','.join(map(str, ids))})
+
+    def test_order_and_missing_ids(self):
+        missing_id = self.phone.id + 100
+        response = self.multi_get([self.phone.id, missing_id, self.laptop.id])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data['results']], [self.phone.id, self.laptop.id])
+        self.assertEqual(response.data['missing'], [missing_id])
+        full = self.client.get(reverse('product-detail', args=[self.phone.id])).json()
+        self.assertEqual(response.json()['results'][0], full)
+
+    def test_served_from_cache_and_invalidated(self):
+        self.multi_get([self.laptop.id])
+        with self.assertNumQueries(0):
+            self.multi_get([self.laptop.id])
+
+        self.category.name = 'Computers'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        response = self.multi_get([self.laptop.id])
+        self.assertEqual(response.data['results'][0]['categories'][0]['name'], 'Computers')
+
+        self.laptop.name = 'Notebook'
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.laptop.save()
+        # До фиксации транзакции кэш не сбрасывается
+        self.assertEqual(self.multi_get([self.laptop.id]).data['results'][0]['name'], 'Laptop')
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.multi_get([self.laptop.id]).data['results'][0]['name'], 'Notebook')
+
+    def test_evicted_version_does_not_revive_entries(self):
+        self.multi_get([self.laptop.id])
+        for name, key in (('Notebook', product_cache.CATEGORY_VERSION_KEY),
+                          ('Ultrabook', f'shop:product_version:{self.laptop.id}')):
+            # Изменение в обход сигналов: старая запись остаётся в кэше
+            Product.objects.filter(pk=self.laptop.pk).update(name=name)
+            django_cache.delete(key)
+            self.assertEqual(self.multi_get([self.laptop.id]).data['results'][0]['name'], name)
+
+    def test_stale_fill_after_invalidation_is_not_served(self):
+        versions = product_cache.versions([self.laptop.id])
+        stale = ProductProjection(expand=['categories']).serialize(Product.objects.filter(pk=self.laptop.pk))
+        self.laptop.name = 'Notebook'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.laptop.save()
+        # Запрос, прочитавший базу до изменения, заполняет кэш уже после сброса
+        product_cache.set_products(stale, versions)
+        self.assertEqual(self.multi_get([self.laptop.id]).data['results'][0]['name'], 'Notebook')
+
+    def test_projection_params_rejected(self):
+        for params in ({'fields': 'id'}, {'expand': 'categories'}):
+            response = self.client.get(reverse('product-list'), {'ids': self.laptop.id, **params})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_too_many_ids(self):
+        response = self.multi_get(range(1, 102))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CategorySubtreeOperationsTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='manager', password='12345')
+        self.client.login(username='manager', password='12345')
+        self.root = Category.objects.create(name='Catalog')
+        self.books = Category.objects.create(name='Books', parent=self.root)
+        self.electronics = Category.objects.create(name='Electronics', parent=self.root)
+        self.laptops = Category.objects.create(name='Laptops', parent=self.electronics)
+        self.laptop = Product.objects.create(name='Laptop', description='A powerful laptop', price=1000)
+        self.laptop.categories.set([self.laptops])
+        self.book = Product.objects.create(name='Book', description='A novel', price=20)
+        self.book.categories.set([self.books, self.laptops])
+
+    def test_delete_subtree_requires_admin(self):
+        response = self.client.delete(reverse('category-detail', args=[self.electronics.id]))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertTrue(Category.objects.filter(pk=self.laptops.pk).exists())
+
+    def test_delete_subtree(self):
+        self.login_admin()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(reverse('category-detail', args=[self.electronics.id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        self.assertEqual(set(Category.objects.values_list('name', flat=True)), {'Catalog', 'Books'})
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(list(self.book.categories.all()), [self.books])
+        self.assertFalse(ProductCategoryIndex.objects.filter(product=self.laptop).exists())
+        self.assertEqual(set(ProductCategoryIndex.objects.filter(product=self.book).values_list('category_id', flat=True)),
+                         {self.root.id, self.books.id})
+
+        root = Category.objects.get(pk=self.root.pk)
+        self.assertEqual((root.lft, root.rght), (1, 4))
+        Category.objects.create(name='Toys', parent=root)
+        self.assertEqual(Category.objects.get(pk=self.root.pk).get_descendant_count(), 2)
+
+    def login_admin(self):
+        User.objects.create_superuser(username='admin', password='12345')
+        self.client.login(username='admin', password='12345')
+
+    def test_reprice_subtree(self):
+        self.login_admin()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('category-reprice', args=[self.electronics.id]), {'percent': -10},
+                                        format='json')
+        self.assertEqual(response.data, {'updated': 2})
+        self.laptop.refresh_from_db()
+        self.book.refresh_from_db()
+        self.assertEqual((self.laptop.price, self.book.price), (Decimal('900.00'), Decimal('18.00')))
+
+        self.assertEqual(reprice_subtree(self.books, amount=Decimal('-50')), 1)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.price, Decimal('0.00'))
+
+    def test_reprice_requires_single_change(self):
+        self.login_admin()
+        response = self.client.post(reverse('category-reprice', args=[self.root.id]), {'percent': 5, 'amount': 1},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_reprice_requires_admin(self):
+        response = self.client.post(reverse('category-reprice', args=[self.root.id]), {'percent': 5}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_reprice_overflow_rejected(self):
+        self.login_admin()
+        url = reverse('category-reprice', args=[self.electronics.id])
+        for data in ({'percent': 10 ** 7}, {'amount': '99999000'}):
+            response = self.client.post(url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, data)
+        self.laptop.refresh_from_db()
+        self.assertEqual(self.laptop.price, Decimal('1000.00'))
+        response = self.client.post(url, {'amount': '99998999.99'}, format='json')
+        self.assertEqual(response.data, {'updated': 2})
@@ -1,13 +1,14 @@
 # shop/urls.py
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ProductViewSet, CartViewSet, OrderViewSet, CategoryViewSet
+from .views import ProductViewSet, CartViewSet, OrderViewSet, CategoryViewSet, ReportViewSet
 
 router = DefaultRouter()
 router.register(r'products', ProductViewSet, basename='product')
 router.register(r'cart', CartViewSet, basename='cart')
 router.register(r'order', OrderViewSet, basename='order')
 router.register(r'categories', CategoryViewSet, basename='category')
+router.register(r'reports', ReportViewSet, basename='report')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,27 +1,51 @@
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from rest_framework import viewsets, status, mixins
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 
-from .models import Product, Cart, CartItem, Order, OrderItem, Category
-from .serializers import ProductSerializer, CartSerializer, OrderSerializer, CategorySerializer
+from . import cache, inventory, outbox, subtree
+from .models import (Product, Cart, CartItem, Order, OrderItem, Category, ProductDailySales, CategoryDailySales,
+                     ProductRecommendation)
+from .recommendations import TOP_K
+from .serializers import ProductSerializer, CartSerializer, OrderSerializer, CategorySerializer, ProductProjection
+
+PROJECTION_PARAMETERS = [
+    openapi.Parameter('fields', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                      description="Поля продукта через запятую: id, name, description, price, categories"),
+    openapi.Parameter('expand', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                      description="'categories' — отдавать категории деревьями предков вместо идентификаторов"),
+]
 
 
 class ProductViewSet(viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    max_multi_get = 100
 
-    def get_all_subcategories(self, category_id):
-        """Рекурсивно получает все подкатегории для заданной категории."""
-        subcategories = [category_id]
-        direct_children = Category.objects.filter(parent_id=category_id)
+    def filter_by_category_subtree(self, queryset, category_id):
+        """Оставляет продукты из категории и всех её подкатегорий (через индекс ProductCategoryIndex)."""
+        return queryset.filter(category_index__category_id=category_id)
 
-        for child in direct_children:
-            subcategories.extend(self.get_all_subcategories(child.id))
+    def get_projection(self):
+        """Проекция по ?fields= / ?expand= или None, если ответ строится полным ProductSerializer."""
+        if not hasattr(self, '_projection'):
+            self._projection = ProductProjection.from_query_params(self.request.query_params)
+        return self._projection
 
-        return subcategories
+    def serialize_many(self, queryset):
+        projection = self.get_projection()
+        if projection is not None:
+            return projection.serialize(queryset)
+        return self.get_serializer(queryset, many=True).data
 
     @swagger_auto_schema(
         method='get',
@@ -35,7 +59,7 @@ class ProductViewSet(viewsets.ModelViewSet):
             openapi.Parameter('max_price', openapi.IN_QUERY, description="Максимальная цена", type=openapi.TYPE_NUMBER),
             openapi.Parameter('category_id', openapi.IN_QUERY,
                               description="Идентификатор категории, 0 для игнорирования", type=openapi.TYPE_INTEGER),
-        ],
+        ] + PROJECTION_PARAMETERS,
         responses={200: ProductSerializer(many=True)}
     )
     @action(detail=False, methods=['get'], url_path='filter_by_price_category', name='product-filter_by_price_category')
@@ -50,11 +74,9 @@ class ProductViewSet(viewsets.ModelViewSet):
         if max_price is not None:
             queryset = queryset.filter(price__lte=max_price)
         if category_id and int(category_id) > 0:
-            all_subcategories = self.get_all_subcategories(int(category_id))
-            queryset = queryset.filter(categories__id__in=all_subcategories)
+            queryset = self.filter_by_category_subtree(queryset, int(category_id))
 
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return Response(self.serialize_many(queryset))
 
     @swagger_auto_schema(
         method='post',
@@ -69,6 +91,7 @@ class ProductViewSet(viewsets.ModelViewSet):
                 'category_id': openapi.Schema(type=openapi.TYPE_INTEGER, description='Идентификатор категории')
             },
         ),
+        manual_parameters=PROJECTION_PARAMETERS,
         responses={200: ProductSerializer(many=True)}
     )
     @action(detail=False, methods=['post'], url_path='by_category')
@@ -78,23 +101,93 @@ class ProductViewSet(viewsets.ModelViewSet):
         if category_id is None:
             return Response({'error': 'Идентификатор категории обязателен'}, status=status.HTTP_400_BAD_REQUEST)
 
-        all_subcategories = self.get_all_subcategories(category_id)
-        products = self.queryset.filter(categories__id__in=all_subcategories)
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        products = self.filter_by_category_subtree(self.get_queryset(), category_id)
+        return Response(self.serialize_many(products))
 
+    @swagger_auto_schema(
+        method='get',
+        operation_summary="Часто покупают вместе",
+        operation_description="Товары, которые чаще всего покупали вместе с данным (пересчитываются командой "
+                              "build_recommendations).",
+        tags=['Recommendations'],
+        manual_parameters=[
+            openapi.Parameter('limit', openapi.IN_QUERY, description="Количество товаров, по умолчанию 10",
+                              type=openapi.TYPE_INTEGER),
+        ],
+    )
+    @action(detail=True, methods=['get'])
+    def recommendations(self, request, pk=None):
+        product = self.get_object()
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            return Response({'error': 'limit должен быть целым числом'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, TOP_K))
+
+        rows = (ProductRecommendation.objects.filter(product=product).order_by('-score')
+                .values('recommended_id', 'recommended__name', 'recommended__price', 'score')[:limit])
+        price_field = ProductProjection.price_field
+        return Response([
+            {'id': row['recommended_id'], 'name': row['recommended__name'],
+             'price': price_field.to_representation(row['recommended__price']), 'score': row['score']}
+            for row in rows
+        ])
+
+    def multi_get(self, raw_ids):
+        """Несколько продуктов по id в порядке запроса: сначала из кэша, недостающие — фиксированным числом запросов."""
+        try:
+            ids = list(dict.fromkeys(int(value) for value in raw_ids.split(',') if value.strip()))
+        except ValueError:
+            return Response({'error': 'ids должен быть списком целых чисел через запятую'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > self.max_multi_get:
+            return Response({'error': f'Не больше {self.max_multi_get} идентификаторов за запрос'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Версии — до чтения из базы: тогда устаревшие данные, прочитанные до изменения продукта, лягут в кэш
+        # под старой версией и читаться не будут
+        versions = cache.versions(ids)
+        found = cache.get_products(versions)
+        misses = [product_id for product_id in ids if product_id not in found]
+        if misses:
+            loaded = ProductProjection(expand=['categories']).serialize(self.get_queryset().filter(id__in=misses))
+            cache.set_products(loaded, versions)
+            found.update((item['id'], item) for item in loaded)
+
+        return Response({
+            'results': [found[product_id] for product_id in ids if product_id in found],
+            'missing': [product_id for product_id in ids if product_id not in found],
+        })
+
+    @swagger_auto_schema(manual_parameters=PROJECTION_PARAMETERS + [
+        openapi.Parameter('ids', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          description="Получить продукты по списку id через запятую (не больше 100) в полном "
+                                      "представлении; не сочетается с fields и expand. Ответ: "
+                                      "{'results': [...в порядке запроса], 'missing': [не найденные id]}"),
+    ])
     def list(self, request, *args, **kwargs):
+        if 'ids' in request.query_params:
+            # В кэше лежит только полное представление продукта
+            if 'fields' in request.query_params or 'expand' in request.query_params:
+                return Response({'error': 'ids нельзя сочетать с fields и expand'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            return self.multi_get(request.query_params['ids'])
+
         queryset = self.filter_queryset(self.get_queryset())
         page = self.paginate_queryset(queryset)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+            return self.get_paginated_response(self.serialize_many(page))
 
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return Response(self.serialize_many(queryset))
 
+    @swagger_auto_schema(manual_parameters=PROJECTION_PARAMETERS)
     def retrieve(self, request, *args, **kwargs):
+        projection = self.get_projection()
+        # get_object() проверяет и существование, и права на объект
         instance = self.get_object()
+        if projection is not None:
+            return Response(projection.serialize([instance])[0])
+
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
@@ -122,6 +215,11 @@ class ProductViewSet(viewsets.ModelViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+def out_of_stock_response(exc):
+    return Response({"error": "Недостаточно товара на складе", "product_id": exc.product_id},
+                    status=status.HTTP_409_CONFLICT)
+
+
 class CartViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
 
@@ -158,14 +256,19 @@ class CartViewSet(viewsets.ViewSet):
             return Response({"error": "Продукт не найден"}, status=status.HTTP_404_NOT_FOUND)
 
         cart, _ = Cart.objects.get_or_create(user=request.user)
-        cart_item, created = CartItem.objects.get_or_create(cart=cart, product=product)
-
-        if not created:
-            cart_item.quantity += int(quantity)
-        else:
-            cart_item.quantity = int(quantity)
-
-        cart_item.save()
+        try:
+            with transaction.atomic():
+                cart_item, created = CartItem.objects.select_for_update().get_or_create(cart=cart, product=product)
+
+                if not created:
+                    cart_item.quantity += int(quantity)
+                else:
+                    cart_item.quantity = int(quantity)
+
+                inventory.hold(cart_item, cart_item.quantity)
+                cart_item.save()
+        except inventory.OutOfStock as exc:
+            return out_of_stock_response(exc)
         return Response({'status': 'Товар добавлен или обновлен'}, status=status.HTTP_200_OK)
 
     @swagger_auto_schema(
@@ -193,12 +296,16 @@ class CartViewSet(viewsets.ViewSet):
 
         cart = Cart.objects.get(user=request.user)
         try:
-            cart_item = CartItem.objects.get(cart=cart, product=product)
-            cart_item.quantity = quantity
-            cart_item.save()
+            with transaction.atomic():
+                cart_item = CartItem.objects.select_for_update().get(cart=cart, product=product)
+                cart_item.quantity = int(quantity)
+                inventory.hold(cart_item, cart_item.quantity)
+                cart_item.save()
             return Response({'status': 'Количество товара в корзине обновлено'}, status=status.HTTP_200_OK)
         except CartItem.DoesNotExist:
             return Response({"error": "Товар не найден в корзине"}, status=status.HTTP_404_NOT_FOUND)
+        except inventory.OutOfStock as exc:
+            return out_of_stock_response(exc)
 
     @swagger_auto_schema(
         method='delete',
@@ -218,8 +325,10 @@ class CartViewSet(viewsets.ViewSet):
 
         cart = Cart.objects.get(user=request.user)
         try:
-            cart_item = CartItem.objects.get(cart=cart, product_id=product_id)
-            cart_item.delete()
+            with transaction.atomic():
+                cart_item = CartItem.objects.select_related('product').get(cart=cart, product_id=product_id)
+                inventory.drop(cart_item)
+                cart_item.delete()
             return Response({'status': 'Товар удален'}, status=status.HTTP_200_OK)
         except CartItem.DoesNotExist:
             return Response({"error": "Товар не найден в корзине"}, status=status.HTTP_404_NOT_FOUND)
@@ -227,17 +336,55 @@ class CartViewSet(viewsets.ViewSet):
 
 class OrderViewSet(viewsets.GenericViewSet):
     permission_classes = [IsAuthenticated]
+    history_days = 90
+    max_history_days = 3650
 
-    def create(self, request):
-        cart = Cart.objects.get(user=request.user)
-        if not cart.items.exists():
-            return Response({"error": "Невозможно создать заказ с пустой корзиной."},
-                            status=status.HTTP_400_BAD_REQUEST)
+    @swagger_auto_schema(
+        operation_description="История заказов текущего пользователя за последние дни",
+        manual_parameters=[
+            openapi.Parameter('days', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                              description="Глубина истории в днях, по умолчанию 90"),
+        ],
+        responses={200: OrderSerializer(many=True)}
+    )
+    def list(self, request):
+        """История заказов. Фильтр по created_at позволяет PostgreSQL отсечь старые секции таблицы заказов."""
+        try:
+            days = int(request.query_params.get('days', self.history_days))
+        except ValueError:
+            return Response({"error": "days должен быть целым числом"}, status=status.HTTP_400_BAD_REQUEST)
+        days = max(1, min(days, self.max_history_days))
+
+        since = timezone.now() - timedelta(days=days)
+        orders = (Order.objects.filter(user=request.user, created_at__gte=since)
+                  .prefetch_related('items').order_by('-created_at'))
+        serializer = OrderSerializer(orders, many=True)
+        return Response(serializer.data)
 
-        order = Order.objects.create(user=request.user)
-        items = [OrderItem(order=order, product=item.product, quantity=item.quantity) for item in cart.items.all()]
-        OrderItem.objects.bulk_create(items)
-        cart.items.all().delete()  # Очистить корзину после создания заказа
+    def create(self, request):
+        try:
+            with transaction.atomic():
+                # Блокировка корзины: параллельное оформление той же корзины дождётся этой транзакции
+                # и увидит корзину уже пустой, а не спишет товар второй раз
+                cart = Cart.objects.select_for_update().filter(user=request.user).first()
+                cart_items = list(cart.items.select_related('product')) if cart else []
+                if not cart_items:
+                    return Response({"error": "Невозможно создать заказ с пустой корзиной."},
+                                    status=status.HTTP_400_BAD_REQUEST)
+                inventory.checkout(cart_items)  # Резервы корзины становятся списанием, недостающее берётся со склада
+                order = Order.objects.create(user=request.user)
+                items = [OrderItem(order=order, product_id=item.product_id, quantity=item.quantity)
+                         for item in cart_items]
+                OrderItem.objects.bulk_create(items)
+                cart.items.all().delete()  # Очистить корзину после создания заказа
+                # Уведомления, синхронизация и аналитика выполняются воркером outbox, а не в запросе
+                outbox.publish(outbox.ORDER_CREATED, {
+                    'order_id': order.id,
+                    'user_id': request.user.id,
+                    'items': [{'product_id': item.product_id, 'quantity': item.quantity} for item in items],
+                })
+        except inventory.OutOfStock as exc:
+            return out_of_stock_response(exc)
         serializer = OrderSerializer(order)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -261,3 +408,129 @@ class CategoryViewSet(mixins.CreateModelMixin,
         self.perform_create(serializer)
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+    def get_permissions(self):
+        # Удаление сносит всё поддерево вместе с накопленными продажами — как и reprice, только для администраторов
+        if self.action == 'destroy':
+            return [IsAdminUser()]
+        return super().get_permissions()
+
+    @swagger_auto_schema(operation_summary="Удаление категории",
+                         operation_description="Удаляет категорию вместе со всеми подкатегориями и их статистикой "
+                                               "продаж; продукты остаются. Только для администраторов.")
+    def destroy(self, request, *args, **kwargs):
+        return super().destroy(request, *args, **kwargs)
+
+    def perform_destroy(self, instance):
+        """Удаляет категорию вместе с поддеревом набором массовых запросов вместо каскада Django."""
+        subtree.delete_subtree(instance)
+
+    @swagger_auto_schema(
+        method='post',
+        operation_summary="Изменение цен в поддереве категории",
+        operation_description="Меняет цены всех продуктов категории и её подкатегорий на процент или на "
+                              "фиксированную сумму. Нужно передать ровно одно из полей. Только для администраторов.",
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'percent': openapi.Schema(type=openapi.TYPE_NUMBER, description='Изменение в процентах, '
+                                                                                 'например -10'),
+                'amount': openapi.Schema(type=openapi.TYPE_NUMBER, description='Изменение на сумму'),
+            },
+        ),
+        responses={200: openapi.Response(description="Количество изменённых продуктов")}
+    )
+    @action(detail=True, methods=['post'], permission_classes=[IsAdminUser])
+    def reprice(self, request, pk=None):
+        category = self.get_object()
+        percent = request.data.get('percent')
+        amount = request.data.get('amount')
+        if (percent is None) == (amount is None):
+            return Response({"error": "Нужно указать ровно одно из полей percent и amount"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            value = Decimal(str(percent if percent is not None else amount))
+        except InvalidOperation:
+            return Response({"error": "Изменение цены должно быть числом"}, status=status.HTTP_400_BAD_REQUEST)
+        if not value.is_finite() or (percent is not None and value <= -100):
+            return Response({"error": "Некорректное изменение цены"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            if percent is not None:
+                updated = subtree.reprice_subtree(category, percent=value)
+            else:
+                updated = subtree.reprice_subtree(category, amount=value)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'updated': updated}, status=status.HTTP_200_OK)
+
+
+REPORT_PARAMETERS = [
+    openapi.Parameter('date_from', openapi.IN_QUERY, description="Начало периода (YYYY-MM-DD)",
+                      type=openapi.TYPE_STRING, required=True),
+    openapi.Parameter('date_to', openapi.IN_QUERY, description="Конец периода включительно (YYYY-MM-DD)",
+                      type=openapi.TYPE_STRING, required=True),
+    openapi.Parameter('limit', openapi.IN_QUERY, description="Максимум строк, по умолчанию 100",
+                      type=openapi.TYPE_INTEGER),
+]
+
+
+class ReportViewSet(viewsets.ViewSet):
+    """Отчёты о продажах по дневным сводкам (см. shop.rollups); история заказов при этом не читается."""
+    permission_classes = [IsAdminUser]
+    default_limit = 100
+    max_limit = 1000
+
+    def summarize(self, request, model, key_field):
+        try:
+            date_from = parse_date(request.query_params.get('date_from') or '')
+            date_to = parse_date(request.query_params.get('date_to') or '')
+        except ValueError:
+            date_from = date_to = None
+        if date_from is None or date_to is None or date_from > date_to:
+            return Response({'error': 'Нужны корректные date_from и date_to в формате YYYY-MM-DD'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            return Response({'error': 'limit должен быть целым числом'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, self.max_limit))
+
+        queryset = model.objects.filter(date__gte=date_from, date__lte=date_to)
+        key = request.query_params.get(key_field)
+        if key:
+            try:
+                key = int(key)
+            except ValueError:
+                return Response({'error': f'{key_field} должен быть целым числом'}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = queryset.filter(**{key_field: key})
+        rows = (queryset.values(key_field)
+                .annotate(quantity=Sum('quantity'), lines=Sum('lines'))
+                .order_by('-quantity', key_field)[:limit])
+        return Response({'date_from': date_from, 'date_to': date_to, 'results': list(rows)})
+
+    @swagger_auto_schema(
+        operation_summary="Продажи по продуктам",
+        operation_description="Суммарное количество проданных единиц и позиций заказов по продуктам за период.",
+        tags=['Reports'],
+        manual_parameters=REPORT_PARAMETERS + [
+            openapi.Parameter('product_id', openapi.IN_QUERY, description="Только этот продукт",
+                              type=openapi.TYPE_INTEGER),
+        ],
+    )
+    @action(detail=False, methods=['get'])
+    def products(self, request):
+        return self.summarize(request, ProductDailySales, 'product_id')
+
+    @swagger_auto_schema(
+        operation_summary="Продажи по категориям",
+        operation_description="Продажи за период по категориям с учётом всех подкатегорий.",
+        tags=['Reports'],
+        manual_parameters=REPORT_PARAMETERS + [
+            openapi.Parameter('category_id', openapi.IN_QUERY, description="Только эта категория",
+                              type=openapi.TYPE_INTEGER),
+        ],
+    )
+    @action(detail=False, methods=['get'])
+    def categories(self, request):
+        return self.summarize(request, CategoryDailySales, 'category_id')